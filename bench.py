@@ -0,0 +1,185 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import chess
+from PyQt5.QtCore import Qt, QEvent, QPointF
+from PyQt5.QtGui import QMouseEvent
+
+import main
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {"runs": len(ordered),
+            "median_ms": statistics.median(ordered),
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "min_ms": ordered[0],
+            "max_ms": ordered[-1]}
+
+
+def measure(function, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summary(samples)
+
+
+def sample_game(plies, seed=1):
+    rng = random.Random(seed)
+    board = chess.Board()
+    moves = []
+    while len(moves) < plies:
+        candidates = [move for move in board.legal_moves if not board.gives_check(move)]
+        board.push(rng.choice(candidates or list(board.legal_moves)))
+        if board.is_game_over():
+            board.pop()
+            continue
+        moves.append(board.peek())
+    return moves
+
+
+def engine_command(directory):
+    if os.name == "nt":
+        path = os.path.join(directory, "fake_engine.bat")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{os.path.join(APP_ROOT, "fake_engine.py")}" %*\n')
+    else:
+        path = os.path.join(directory, "fake_engine.sh")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(APP_ROOT, "fake_engine.py")}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def click(widget, square):
+    position = widget.board_view.mapTo(widget, widget.board_view.renderer.square_center(square).toPoint())
+    with contextlib.redirect_stdout(io.StringIO()):
+        widget.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, QPointF(position), Qt.LeftButton, Qt.LeftButton,
+                                           Qt.NoModifier))
+
+
+def run(repeat, plies):
+    app = main.QApplication.instance() or main.QApplication(sys.argv)
+    results = {}
+    moves = sample_game(plies)
+
+    widget = main.ChessboardWidget()
+    widget.show()
+    widget.load_game_moves(moves[:40])
+    app.processEvents()
+
+    def paint(function):
+        def wrapper():
+            function()
+            app.processEvents()
+        return wrapper
+
+    results["create_custom_svg"] = measure(widget.create_custom_svg, repeat)
+    results["update_svg"] = measure(paint(widget.update_svg), repeat)
+
+    move = next(move for move in widget.board.legal_moves if not widget.board.gives_check(move))
+    results["click_select"] = measure(paint(lambda: click(widget, move.from_square)), repeat,
+                                      setup=lambda: setattr(widget, "selected_square", None))
+
+    def select():
+        widget.selected_square = None
+        click(widget, move.from_square)
+
+    def undo():
+        if widget.board.move_stack and widget.board.peek() == move:
+            widget.undo_move()
+
+    results["click_move"] = measure(paint(lambda: click(widget, move.to_square)), repeat,
+                                    setup=lambda: (undo(), select()))
+    undo()
+
+    results["update_last_move"] = measure(widget.update_last_move, repeat)
+    results["session_flush"] = measure(widget.session.flush, repeat, setup=lambda: (
+        widget.board.push(move), widget.update_last_move(), widget.board.pop(), widget.update_last_move()))
+
+    dialog = main.ChessBoardDialog(moves, chess.STARTING_FEN)
+    results["replay_step"] = measure(dialog.play_next_move, repeat,
+                                     setup=lambda: dialog.seek(dialog.move_index % (len(moves) - 1)))
+    rng = random.Random(2)
+    results["replay_seek"] = measure(lambda: dialog.seek(rng.randrange(len(moves) + 1)), repeat)
+
+    store = main.get_game_store(os.path.join(os.getcwd(), "bench.db"))
+    game = widget.game_record()
+    results["save_game"] = measure(lambda: store.add_game(game), repeat)
+    game_id = store.add_game(game)
+    results["load_game"] = measure(lambda: widget.open_game(store, game_id), repeat)
+
+    engine_path = engine_command(os.getcwd())
+    board = chess.Board()
+    for move in moves[:40]:
+        board.push(move)
+
+    hub = main.get_engine_hub()
+
+    def cold_search():
+        hub.search(engine_path, main.position_command(board), "go movetime 1", session="cold")
+        hub.close_engines(engine_path, "cold")
+
+    results["engine_cold_round_trip"] = measure(cold_search, max(3, repeat // 10))
+    hub.search(engine_path, "position startpos", "go movetime 1")
+    results["engine_round_trip"] = measure(
+        lambda: hub.search(engine_path, main.position_command(board), "go movetime 1", options={"Hash": 16}), repeat)
+    results["engine_info_stream"] = measure(
+        lambda: hub.search(engine_path, main.position_command(board), "go depth 30",
+                           options={"Hash": 16, "DepthInterval": 0}, on_info=lambda info: None), repeat)
+    main.close_engine_hub()
+    return results
+
+
+def report(results, baseline=None):
+    print(f"{'benchmark':<26}{'median ms':>12}{'p95 ms':>12}" + (f"{'vs base':>10}" if baseline else ""))
+    for name, result in results.items():
+        line = f"{name:<26}{result['median_ms']:>12.3f}{result['p95_ms']:>12.3f}"
+        if baseline and name in baseline and baseline[name]["median_ms"]:
+            line += f"{result['median_ms'] / baseline[name]['median_ms']:>9.2f}x"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the ChessQt GUI hot paths headlessly.")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--plies", type=int, default=120)
+    parser.add_argument("--json", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--compare", help="results JSON of a previous run to compare against")
+    parser.add_argument("--metrics", help="also record internal spans and export them here (.prom or .json)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.json)
+    metrics = os.path.abspath(args.metrics) if args.metrics else ""
+    main.tracer.configure({"enabled": bool(metrics), "export path": metrics})
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        results = run(args.repeat, args.plies)
+        os.chdir(APP_ROOT)
+
+    with open(output, "w") as f:
+        json.dump({"timestamp": time.time(), "python": sys.version.split()[0], "chess": chess.__version__,
+                   "repeat": args.repeat, "results": results}, f, indent=2)
+    report(results, baseline)
+    main.tracer.dump()
@@ -0,0 +1,233 @@
+import argparse
+import collections
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+
+import chess
+
+import main
+
+
+def position_board(position):
+    tokens = position.split()
+    moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+    board = chess.Board(" ".join(tokens[2:moves])) if len(tokens) > 1 and tokens[1] == "fen" else chess.Board()
+    for move in tokens[moves + 1:]:
+        board.push_uci(move)
+    return board
+
+
+def go_limits(go):
+    tokens = go.split()
+    limits = {}
+    for name in ("depth", "movetime"):
+        if name in tokens[:-1]:
+            limits[name] = int(tokens[tokens.index(name) + 1])
+    return limits if len(limits) == 1 and len(tokens) == 3 else {}
+
+
+class Job:
+    def __init__(self, connection, message):
+        self.connection = connection
+        self.id = message["id"]
+        self.client = str(message.get("client") or id(connection))
+        self.position = message["position"]
+        self.go = message["go"]
+        self.options = message.get("options") or {}
+        self.info = message.get("info", False)
+        self.early_stop = message.get("early_stop", 0)
+        self.new_game = message.get("new_game", False)
+        self.request = main.EngineRequest()
+
+
+class EngineDaemon:
+    def __init__(self, path, engines=2, client_slots=1, client_threads=1, max_hash=256, max_queue=16,
+                 cache_path="eval_cache.db"):
+        self.path = path
+        self.client_slots = client_slots
+        self.client_threads = client_threads
+        self.max_hash = max_hash
+        self.max_queue = max_queue
+        self.cache = main.EvalCache(cache_path)
+        self.condition = threading.Condition()
+        self.queues = collections.OrderedDict()
+        self.running = collections.Counter()
+        self.closed = False
+        self.hub = main.get_engine_hub()
+        self.workers = [threading.Thread(target=self.work, args=(f"pool{index}",), daemon=True)
+                        for index in range(engines)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, job):
+        with self.condition:
+            queue = self.queues.setdefault(job.client, collections.deque())
+            if len(queue) >= self.max_queue:
+                return False
+            queue.append(job)
+            self.condition.notify()
+        return True
+
+    def cancel(self, job):
+        job.request.cancel()
+        with self.condition:
+            queue = self.queues.get(job.client)
+            if queue is not None and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self.queues[job.client]
+                job.connection.send({"id": job.id, "result": None})
+
+    def next_job(self):
+        for client, queue in list(self.queues.items()):
+            if not queue:
+                del self.queues[client]
+                continue
+            if self.running[client] >= self.client_slots:
+                continue
+            job = queue.popleft()
+            del self.queues[client]
+            if queue:
+                self.queues[client] = queue
+            self.running[client] += 1
+            return job
+        return None
+
+    def wait_job(self):
+        with self.condition:
+            job = self.next_job()
+            while job is None and not self.closed:
+                self.condition.wait()
+                job = self.next_job()
+            return job
+
+    def work(self, session):
+        while True:
+            try:
+                job = self.wait_job()
+            except Exception:
+                continue
+            if job is None:
+                return
+            try:
+                self.run_job(session, job)
+            except main.EngineTerminated:
+                job.connection.send({"id": job.id, "error": "terminated"})
+            except Exception as error:
+                job.connection.send({"id": job.id, "error": str(error) or type(error).__name__})
+            finally:
+                with self.condition:
+                    self.running[job.client] -= 1
+                    if not self.running[job.client]:
+                        del self.running[job.client]
+                    self.condition.notify_all()
+
+    def run_job(self, session, job):
+        options = dict(job.options)
+        options["Threads"] = min(int(options.get("Threads", 1)), self.client_threads)
+        options["Hash"] = min(int(options.get("Hash", 16)), self.max_hash)
+        board = position_board(job.position)
+        identity = main.engine_identity(self.path, options)
+        limits = go_limits(job.go)
+        result = self.cache.get(board, identity, **limits) if limits else None
+        if result is None:
+            on_info = (lambda info: job.connection.send({"id": job.id, "info": info})) if job.info else None
+            result = self.hub.search(self.path, job.position, job.go, options=options, on_info=on_info,
+                                     early_stop=job.early_stop, request=job.request, new_game=job.new_game,
+                                     session=session)
+            if result is not None and limits:
+                self.cache.put(board, identity, result, limits.get("movetime", 0))
+        job.connection.send({"id": job.id, "result": result})
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for queue in self.queues.values():
+                for job in queue:
+                    job.request.cancel()
+            self.queues.clear()
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(5)
+        self.hub.close_engines()
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super(DaemonHandler, self).setup()
+        self.write_lock = threading.Lock()
+        self.jobs = {}
+
+    def send(self, message):
+        try:
+            with self.write_lock:
+                self.wfile.write((json.dumps(message) + "\n").encode())
+                self.wfile.flush()
+        except (OSError, ValueError):
+            pass
+
+    def handle(self):
+        daemon = self.server.engine_daemon
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if message.get("op") == "search":
+                    job = Job(self, message)
+                    self.jobs[job.id] = job
+                    if not daemon.submit(job):
+                        self.send({"id": job.id, "error": "busy"})
+                elif message.get("op") == "cancel" and message.get("id") in self.jobs:
+                    daemon.cancel(self.jobs[message["id"]])
+        except OSError:
+            pass
+        finally:
+            for job in self.jobs.values():
+                daemon.cancel(job)
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, engine_daemon):
+        self.engine_daemon = engine_daemon
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super(DaemonServer, self).__init__(socket_path, DaemonHandler)
+        os.chmod(socket_path, 0o600)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Share a fixed pool of UCI engines between ChessQt windows.")
+    parser.add_argument("--socket", default=os.path.join(os.path.expanduser("~"), ".chessqt-engine.sock"),
+                        help="Unix socket to listen on; put the same path in the settings as the daemon socket")
+    parser.add_argument("--engine", help="engine binary (defaults to the engine in settings.json)")
+    parser.add_argument("--engines", type=int, default=max(1, (os.cpu_count() or 2) // 8),
+                        help="number of engine processes in the pool")
+    parser.add_argument("--client-slots", type=int, default=1, help="engines one client may use at once")
+    parser.add_argument("--client-threads", type=int, default=max(1, (os.cpu_count() or 2) // 4),
+                        help="upper bound for the Threads option a client may request")
+    parser.add_argument("--max-hash", type=int, default=256, help="upper bound for the Hash option in MB")
+    parser.add_argument("--max-queue", type=int, default=16, help="queued searches per client before 'busy'")
+    parser.add_argument("--cache", default="eval_cache.db", help="shared evaluation cache")
+    args = parser.parse_args()
+
+    engine_daemon = EngineDaemon(os.path.abspath(args.engine or main.settings.resolve_engine()), args.engines,
+                                 args.client_slots, args.client_threads, args.max_hash, args.max_queue, args.cache)
+    server = DaemonServer(args.socket, engine_daemon)
+    print(f"serving {engine_daemon.path} x{args.engines} on {args.socket}", flush=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        engine_daemon.close()
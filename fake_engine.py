@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shlex
+import sys
+import threading
+import time
+import zlib
+
+import chess
+
+OPTIONS = {
+    "Hash": ("spin", 16, 1, 1048576),
+    "Threads": ("spin", 1, 1, 1024),
+    "Skill Level": ("spin", 20, 0, 20),
+    "Ponder": ("check", False),
+    "DepthInterval": ("spin", 1, 0, 10000),
+    "MaxDepth": ("spin", 30, 1, 245),
+    "StableDepth": ("spin", 4, 1, 245),
+    "NodesPerMs": ("spin", 1000, 1, 100000000),
+    "CrashAfter": ("spin", 0, 0, 1000000),
+    "HangAfter": ("spin", 0, 0, 1000000),
+    "Seed": ("spin", 0, 0, 2147483647),
+}
+
+
+def ranked_moves(seed, board, moves=None):
+    prefix = zlib.crc32(f"{seed} {board.fen()} ".encode())
+    return sorted(moves or board.legal_moves, key=lambda move: zlib.crc32(move.uci().encode(), prefix), reverse=True)
+
+
+class Search(threading.Thread):
+    def __init__(self, engine, board, limits):
+        super(Search, self).__init__(daemon=True)
+        self.engine = engine
+        self.board = board
+        self.limits = limits
+        self.options = dict(engine.options)
+        self.stopped = threading.Event()
+        self.pondering = limits.get("ponder", False)
+        self.started = time.monotonic()
+        self.lines = {}
+
+    def budget(self):
+        if "movetime" in self.limits:
+            return self.limits["movetime"]
+        side = "w" if self.board.turn == chess.WHITE else "b"
+        if f"{side}time" in self.limits:
+            moves_to_go = self.limits.get("movestogo", 30)
+            return self.limits[f"{side}time"] / max(1, moves_to_go) + self.limits.get(f"{side}inc", 0)
+        return None
+
+    def elapsed(self):
+        return (time.monotonic() - self.started) * 1000
+
+    def waiting(self):
+        return self.pondering or self.limits.get("infinite")
+
+    def finished(self, depth):
+        if self.stopped.is_set():
+            return True
+        if depth >= min(self.limits.get("depth", self.options["MaxDepth"]), self.options["MaxDepth"]):
+            return True
+        if self.waiting():
+            return False
+        budget = self.budget()
+        if budget is not None and self.elapsed() >= budget:
+            return True
+        return "nodes" in self.limits and self.nodes() >= self.limits["nodes"]
+
+    def nodes(self):
+        return max(1, int(self.elapsed() * self.options["NodesPerMs"]))
+
+    def line(self, move):
+        if move not in self.lines:
+            board = self.board.copy()
+            board.push(move)
+            line = [move]
+            while len(line) < 8 and not board.is_game_over():
+                line.append(ranked_moves(self.options["Seed"], board)[0])
+                board.push(line[-1])
+            self.lines[move] = line
+        return self.lines[move]
+
+    def principal_variation(self, depth):
+        if "candidates" not in self.lines:
+            self.lines["candidates"] = ranked_moves(self.options["Seed"], self.board, self.limits.get("searchmoves"))
+        candidates = self.lines["candidates"]
+        if not candidates:
+            return []
+        stable = self.options["StableDepth"]
+        return self.line(candidates[min(max(stable - depth, 0), len(candidates) - 1)])[:depth]
+
+    def score(self, pv):
+        return self.lines["candidates"].index(pv[0]) % 61 - 30
+
+    def run(self):
+        depth = 0
+        pv = []
+        interval = self.options["DepthInterval"] / 1000
+        while True:
+            if depth and self.finished(depth):
+                break
+            depth += 1
+            pv = self.principal_variation(depth)
+            if not pv:
+                break
+            elapsed = max(1, int(self.elapsed()))
+            self.engine.send(f"info depth {depth} seldepth {depth + 2} multipv 1 score cp {self.score(pv)} "
+                             f"nodes {self.nodes()} nps {self.nodes() * 1000 // elapsed} time {elapsed} "
+                             f"pv {' '.join(move.uci() for move in pv)}")
+            if interval:
+                self.stopped.wait(interval)
+        while self.waiting() and not self.stopped.is_set():
+            self.stopped.wait(0.001)
+        if not pv:
+            self.engine.send("bestmove (none)")
+        elif len(pv) > 1:
+            self.engine.send(f"bestmove {pv[0].uci()} ponder {pv[1].uci()}")
+        else:
+            self.engine.send(f"bestmove {pv[0].uci()}")
+
+
+class FakeEngine:
+    def __init__(self, options, startup=0):
+        self.options = {name: spec[1] for name, spec in OPTIONS.items()}
+        self.options.update(options)
+        self.startup = startup
+        self.board = chess.Board()
+        self.search = None
+        self.searches = 0
+        self.output_lock = threading.Lock()
+
+    def send(self, line):
+        with self.output_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    def uci(self):
+        time.sleep(self.startup / 1000)
+        self.send("id name FakeEngine")
+        self.send("id author ChessQt")
+        for name, spec in OPTIONS.items():
+            if spec[0] == "spin":
+                self.send(f"option name {name} type spin default {self.options[name]} min {spec[2]} max {spec[3]}")
+            else:
+                self.send(f"option name {name} type check default {str(self.options[name]).lower()}")
+        self.send("uciok")
+
+    def set_option(self, tokens):
+        if "value" not in tokens:
+            return
+        name = " ".join(tokens[2:tokens.index("value")])
+        value = " ".join(tokens[tokens.index("value") + 1:])
+        spec = OPTIONS.get(name)
+        if spec is None:
+            return
+        if spec[0] == "spin":
+            try:
+                self.options[name] = min(max(int(value), spec[2]), spec[3])
+            except ValueError:
+                pass
+        else:
+            self.options[name] = value.lower() == "true"
+
+    def position(self, tokens):
+        moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+        self.board = chess.Board(" ".join(tokens[2:moves])) if tokens[1] == "fen" else chess.Board()
+        for move in tokens[moves + 1:]:
+            self.board.push_uci(move)
+
+    def go(self, tokens):
+        self.stop()
+        self.searches += 1
+        if self.options["CrashAfter"] and self.searches >= self.options["CrashAfter"]:
+            os._exit(3)
+        if self.options["HangAfter"] and self.searches >= self.options["HangAfter"]:
+            while True:
+                time.sleep(3600)
+        limits = {}
+        index = 1
+        while index < len(tokens):
+            token = tokens[index]
+            if token in ("ponder", "infinite"):
+                limits[token] = True
+                index += 1
+            elif token == "searchmoves":
+                moves = []
+                index += 1
+                while index < len(tokens) and tokens[index] not in ("ponder", "infinite", "depth", "nodes",
+                                                                       "movetime", "wtime", "btime", "winc",
+                                                                       "binc", "movestogo", "mate"):
+                    moves.append(chess.Move.from_uci(tokens[index]))
+                    index += 1
+                limits["searchmoves"] = [move for move in moves if self.board.is_legal(move)]
+            elif index + 1 < len(tokens):
+                limits[token] = int(tokens[index + 1])
+                index += 2
+            else:
+                index += 1
+        self.search = Search(self, self.board.copy(), limits)
+        self.search.start()
+
+    def ponderhit(self):
+        if self.search is not None:
+            self.search.pondering = False
+
+    def stop(self):
+        if self.search is not None:
+            self.search.pondering = False
+            self.search.stopped.set()
+            self.search.join()
+            self.search = None
+
+    def run(self, stream):
+        for line in stream:
+            tokens = line.split()
+            if not tokens:
+                continue
+            command = tokens[0]
+            if command == "uci":
+                self.uci()
+            elif command == "isready":
+                self.send("readyok")
+            elif command == "setoption":
+                self.set_option(tokens)
+            elif command == "ucinewgame":
+                self.stop()
+                self.board = chess.Board()
+            elif command == "position":
+                self.position(tokens)
+            elif command == "go":
+                self.go(tokens)
+            elif command == "ponderhit":
+                self.ponderhit()
+            elif command == "stop":
+                self.stop()
+            elif command == "quit":
+                break
+        self.stop()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Deterministic stand-in UCI engine for tests and benchmarks.")
+    parser.add_argument("--startup", type=int, default=0, help="ms to wait before answering uci")
+    for name, spec in OPTIONS.items():
+        if spec[0] == "spin" and name not in ("Hash", "Threads", "Skill Level"):
+            parser.add_argument("--" + "".join("-" + c.lower() if c.isupper() else c for c in name).lstrip("-"),
+                                dest=name, type=int, default=spec[1])
+    return parser.parse_args(shlex.split(os.environ.get("FAKE_ENGINE_ARGS", "")) + argv)
+
+
+def main():
+    args = vars(parse_args(sys.argv[1:]))
+    startup = args.pop("startup")
+    FakeEngine(args, startup).run(sys.stdin)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,1597 @@
+import asyncio
+import atexit
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import itertools
 import json
+import math
+import multiprocessing
 import os
 import sqlite3
+import struct
 import subprocess
 import sys
+import threading
+import time
 
 import chess
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
-from PyQt5.QtSvg import QSvgWidget
+import chess.pgn
+import chess.polyglot
+import chess.syzygy
+from PyQt5.QtCore import (Qt, QObject, QThread, pyqtSignal, QTimer, QRectF, QPointF, QByteArray, QAbstractTableModel,
+                          QModelIndex)
+from PyQt5.QtGui import QPainter, QPixmap, QColor, QRadialGradient, QPolygonF, QPen
+from PyQt5.QtSvg import QSvgWidget, QSvgRenderer
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QListWidget, QListWidgetItem,
                              QPushButton, QTabWidget, QComboBox, QTextEdit, QMessageBox, QFileDialog, QAction, QDialog,
-                             QLineEdit, QLabel, QHBoxLayout)
+                             QLineEdit, QLabel, QHBoxLayout, QTableView, QAbstractItemView, QProgressDialog,
+                             QTableWidget, QTableWidgetItem, QSlider, QCheckBox)
 from chess import svg
 
 
 class ChessboardApp(QApplication):
     def __init__(self, sys_argv):
         super(ChessboardApp, self).__init__(sys_argv)
+        self.aboutToQuit.connect(close_engine_hub)
+        tracer.configure(settings.section("metrics"))
+        settings.engine_path()
+        self.aboutToQuit.connect(self.dump_metrics)
         self.main_window = ChessboardMainWindow()
+        self.aboutToQuit.connect(self.main_window.central_widget.session.flush)
         self.main_window.show()
 
+    @staticmethod
+    def dump_metrics():
+        if tracer.enabled:
+            try:
+                tracer.dump()
+            except OSError:
+                pass
+
+
+ENGINE_NAMES = ("stockfish", "lc0", "leela", "komodo", "dragon", "berserk", "ethereal", "rubichess", "koivisto",
+                "arasan", "crafty", "fruit")
 
-def find_exe_file_in_app_root(file_name_part):
-    app_root = os.path.dirname(os.path.abspath(__file__))
 
-    for root, dirs, files in os.walk(app_root):
-        for file in files:
-            if file_name_part.lower() in file.lower() and file.endswith(".exe"):
-                return os.path.join(root, file)
+def is_executable(path):
+    if os.name == "nt":
+        return path.lower().endswith(".exe") and os.path.isfile(path)
+    return os.path.isfile(path) and os.access(path, os.X_OK)
 
+
+def uci_handshake(path, timeout=3):
+    try:
+        process = subprocess.Popen(
+            [path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        )
+    except (OSError, ValueError):
+        return None
+    try:
+        output, _ = process.communicate("uci\nquit\n", timeout=timeout)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        process.kill()
+        process.wait()
+        return None
+    name = None
+    for line in output.splitlines():
+        if line.startswith("id name "):
+            name = line[8:].strip()
+        elif line.strip() == "uciok":
+            return name or os.path.basename(path)
     return None
 
 
+class EngineRegistry:
+    def __init__(self, path="engines.json", app_root=None):
+        self.path = path
+        self.app_root = app_root or os.path.dirname(os.path.abspath(__file__))
+        self.lock = threading.Lock()
+        self.cache = None
+
+    def load_cache(self):
+        if self.cache is None:
+            try:
+                with open(self.path) as f:
+                    self.cache = json.load(f)
+            except Exception:
+                self.cache = {}
+            self.cache.setdefault("dirs", {})
+            self.cache.setdefault("files", {})
+        return self.cache
+
+    def save_cache(self):
+        try:
+            SessionStore.atomic_write(self.path, json.dumps(self.cache))
+        except OSError:
+            pass
+
+    @staticmethod
+    def matches_name(file_name):
+        file_name = file_name.lower()
+        return any(name in file_name for name in ENGINE_NAMES)
+
+    def candidate_dirs(self, extra_dirs):
+        roots = [(directory, True, True) for directory in extra_dirs if directory]
+        roots.append((self.app_root, True, False))
+        roots += [(directory, False, False) for directory in os.environ.get("PATH", "").split(os.pathsep) if directory]
+        return roots
+
+    def walk(self, root, recursive):
+        if not recursive:
+            yield root
+            return
+        for directory, dirs, _ in os.walk(root):
+            dirs[:] = [name for name in dirs if not name.startswith(".") and name != "__pycache__"]
+            yield directory
+
+    def dir_mtime(self, directory):
+        try:
+            return os.stat(directory).st_mtime
+        except OSError:
+            return None
+
+    def file_stamp(self, path):
+        try:
+            stat = os.stat(path)
+            return [stat.st_size, stat.st_mtime]
+        except OSError:
+            return None
+
+    def is_fresh(self, extra_dirs):
+        cache = self.load_cache()
+        if cache.get("roots") != [list(root) for root in self.candidate_dirs(extra_dirs)]:
+            return False
+        if any(self.dir_mtime(directory) != mtime for directory, mtime in cache["dirs"].items()):
+            return False
+        return all(self.file_stamp(path) == entry["stamp"] for path, entry in cache["files"].items())
+
+    def scan(self, extra_dirs=(), force=False):
+        extra_dirs = [os.path.abspath(directory) for directory in extra_dirs if directory]
+        with self.lock:
+            if not force and self.is_fresh(extra_dirs):
+                return self.engines()
+            cache = self.load_cache()
+            known = {} if force else cache["files"]
+            dirs = {}
+            files = {}
+            for root, recursive, any_name in self.candidate_dirs(extra_dirs):
+                for directory in self.walk(root, recursive):
+                    directory = os.path.abspath(directory)
+                    if directory in dirs:
+                        continue
+                    dirs[directory] = self.dir_mtime(directory)
+                    try:
+                        names = os.listdir(directory)
+                    except OSError:
+                        continue
+                    for file_name in names:
+                        path = os.path.join(directory, file_name)
+                        if path in files or not (any_name or self.matches_name(file_name)) or not is_executable(path):
+                            continue
+                        stamp = self.file_stamp(path)
+                        entry = known.get(path)
+                        if entry is None or entry["stamp"] != stamp:
+                            entry = {"stamp": stamp, "name": uci_handshake(path)}
+                        files[path] = entry
+            cache["roots"] = [list(root) for root in self.candidate_dirs(extra_dirs)]
+            cache["dirs"] = dirs
+            cache["files"] = files
+            self.save_cache()
+            return self.engines()
+
+    def engines(self):
+        cache = self.load_cache()
+        engines = [(entry["name"], path) for path, entry in cache["files"].items() if entry["name"]]
+        return sorted(engines, key=lambda engine: (
+            "stockfish" not in (engine[0] + os.path.basename(engine[1])).lower(), engine[0].lower(), engine[1]))
+
+    def default_engine(self, extra_dirs=()):
+        engines = self.scan(extra_dirs)
+        return engines[0][1] if engines else None
+
+
+engine_registry = None
+
+
+def get_engine_registry():
+    global engine_registry
+    if engine_registry is None:
+        engine_registry = EngineRegistry()
+    return engine_registry
+
+
+def find_engine(extra_dirs=""):
+    return get_engine_registry().default_engine(extra_dirs.split(os.pathsep) if extra_dirs else ())
+
+
+SETTINGS_SCHEMA = {
+    "analyse": {"skill level(min=1, max=20)": (20, 1, 20), "hash(mb)": (1024, 1, 1048576), "threads": (128, 1, 1024),
+                "analyse time": (3000, 1, 3600000)},
+    "bot": {"skill level(min=1, max=20)": (20, 1, 20), "hash(mb)": (1024, 1, 1048576), "threads": (128, 1, 1024),
+            "move time": (3000, 1, 3600000), "ponder": (False,), "early stop(iterations)": (0, 0, 100)},
+    "clock": {"enabled": (False,), "base(s)": (300, 1, 36000), "increment(s)": (2, 0, 600)},
+    "game analysis": {"enabled": (False,), "depth": (12, 1, 245), "threads": (1, 1, 1024)},
+    "engine(stockfish)": {"path": ("",), "dirs": ("",), "daemon socket": ("",)},
+    "book": {"path": ("",), "depth(plies)": (16, 0, 1000), "selection": ("weighted", "weighted", "best")},
+    "syzygy": {"path": ("",)},
+    "metrics": {"enabled": (False,), "export path": ("metrics.prom",)},
+}
+
+
+def validate_setting(value, rule):
+    default = rule[0]
+    if isinstance(default, bool):
+        return value if isinstance(value, bool) else default
+    if isinstance(default, int):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return default
+        return min(max(value, rule[1]), rule[2])
+    if value is None:
+        return default
+    value = str(value)
+    if len(rule) > 1 and value not in rule[1:]:
+        return default
+    return value
+
+
+def validate_settings(data):
+    data = data if isinstance(data, dict) else {}
+    settings = {}
+    for section, keys in SETTINGS_SCHEMA.items():
+        values = data.get(section)
+        values = values if isinstance(values, dict) else {}
+        settings[section] = {key: validate_setting(values.get(key), rule) for key, rule in keys.items()}
+    return settings
+
+
+class Settings(QObject):
+    changed = pyqtSignal(dict)
+    engine_resolved = pyqtSignal(str)
+
+    def __init__(self, path="settings.json"):
+        super(Settings, self).__init__()
+        self.path = path
+        self.lock = threading.RLock()
+        self.mtime = None
+        self.data = validate_settings({})
+        self.resolved_engine = None
+        self.resolving = False
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            try:
+                with open(self.path) as f:
+                    data = validate_settings(json.load(f))
+            except Exception:
+                data = validate_settings({})
+            self.replace(data)
+
+    def replace(self, data):
+        with self.lock:
+            old, self.data = self.data, data
+        changes = {section: {key: value for key, value in values.items() if old[section][key] != value}
+                   for section, values in data.items()}
+        changes = {section: values for section, values in changes.items() if values}
+        if changes:
+            self.changed.emit(changes)
+
+    def section(self, name):
+        self.reload()
+        with self.lock:
+            return dict(self.data[name])
+
+    def get(self, section, key):
+        self.reload()
+        with self.lock:
+            return self.data[section][key]
+
+    def snapshot(self):
+        self.reload()
+        with self.lock:
+            return {section: dict(values) for section, values in self.data.items()}
+
+    def update(self, data):
+        data = validate_settings(data)
+        with self.lock:
+            SessionStore.atomic_write(self.path, json.dumps(data))
+            self.mtime = os.stat(self.path).st_mtime_ns
+            self.replace(data)
+
+    def set(self, section, key, value):
+        data = self.snapshot()
+        data[section][key] = value
+        self.update(data)
+
+    def engine_path(self):
+        engine = self.section("engine(stockfish)")
+        if engine["path"]:
+            return engine["path"]
+        with self.lock:
+            if self.resolved_engine is not None and self.resolved_engine[0] == engine["dirs"]:
+                return self.resolved_engine[1]
+        self.resolve_engine_async()
+        return ""
+
+    def resolve_engine(self, force=False):
+        engine = self.section("engine(stockfish)")
+        if engine["path"] and not force:
+            return engine["path"]
+        if force:
+            get_engine_registry().scan(engine["dirs"].split(os.pathsep) if engine["dirs"] else (), force=True)
+        path = find_engine(engine["dirs"]) or ""
+        with self.lock:
+            self.resolved_engine = (engine["dirs"], path)
+        self.engine_resolved.emit(path)
+        return path
+
+    def resolve_engine_async(self, force=False):
+        with self.lock:
+            if self.resolving:
+                return
+            self.resolving = True
+
+        def resolve():
+            try:
+                self.resolve_engine(force)
+            finally:
+                with self.lock:
+                    self.resolving = False
+
+        threading.Thread(target=resolve, daemon=True).start()
+
+    def engine_options(self, role):
+        values = self.section(role)
+        return {"Skill Level": values["skill level(min=1, max=20)"], "Hash": values["hash(mb)"],
+                "Threads": values["threads"]}
+
+
+settings = Settings()
+
+
+def apply_settings_changes(changes):
+    if "metrics" in changes:
+        tracer.configure(settings.section("metrics"))
+    if {"path", "daemon socket"} & set(changes.get("engine(stockfish)", {})):
+        threading.Thread(target=close_engine_hub, daemon=True).start()
+        return
+    if engine_hub is None or settings.get("engine(stockfish)", "daemon socket"):
+        return
+    for role in ("bot", "analyse"):
+        if role in changes:
+            engine_hub.configure(settings.engine_path(), settings.engine_options(role))
+
+
+settings.changed.connect(apply_settings_changes)
+
+
+class Span:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class Tracer:
+    buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.enabled = False
+        self.export_path = ""
+        self.null_span = contextlib.nullcontext()
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def configure(self, metrics_settings):
+        self.enabled = bool(metrics_settings.get("enabled", False))
+        self.export_path = metrics_settings.get("export path", "")
+
+    def span(self, name):
+        if not self.enabled:
+            return self.null_span
+        return Span(self, name)
+
+    def record(self, name, duration):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {"counts": [0] * (len(self.buckets) + 1), "count": 0,
+                                                     "sum": 0.0, "max": 0.0}
+            histogram["counts"][bisect.bisect_left(self.buckets, duration)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += duration
+            histogram["max"] = max(histogram["max"], duration)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def quantile(self, histogram, q):
+        rank = q * histogram["count"]
+        seen = 0
+        for index, count in enumerate(histogram["counts"]):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else histogram["max"]
+                return min(lower + (upper - lower) * (rank - seen) / count, histogram["max"])
+            seen += count
+        return 0.0
+
+    def summary(self):
+        with self.lock:
+            histograms = {name: dict(histogram, counts=list(histogram["counts"]))
+                          for name, histogram in self.histograms.items()}
+        return {name: {"count": histogram["count"], "mean_ms": histogram["sum"] / histogram["count"],
+                       "p50_ms": self.quantile(histogram, 0.5), "p95_ms": self.quantile(histogram, 0.95),
+                       "p99_ms": self.quantile(histogram, 0.99), "max_ms": histogram["max"],
+                       "buckets_ms": list(self.buckets), "counts": histogram["counts"]}
+                for name, histogram in sorted(histograms.items())}
+
+    def prometheus_text(self):
+        lines = ["# HELP chessqt_span_duration_seconds Duration of instrumented ChessQt operations.",
+                 "# TYPE chessqt_span_duration_seconds histogram"]
+        for name, histogram in self.summary().items():
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound / 1000:g}"
+                lines.append(f'chessqt_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'chessqt_span_duration_seconds_sum{{span="{name}"}} '
+                         f'{histogram["mean_ms"] * histogram["count"] / 1000:g}')
+            lines.append(f'chessqt_span_duration_seconds_count{{span="{name}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path=None):
+        path = path or self.export_path
+        if not path or not self.histograms:
+            return
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(self.summary(), f, indent=2)
+            else:
+                f.write(self.prometheus_text())
+
+
+tracer = Tracer()
+
+
+class EngineTerminated(Exception):
+    pass
+
+
+def parse_info(line):
+    tokens = line.split()
+    info = {}
+    i = 1
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("depth", "seldepth", "multipv", "nodes", "nps", "time", "hashfull") and i + 1 < len(tokens):
+            info[token] = int(tokens[i + 1])
+            i += 2
+        elif token == "score" and i + 2 < len(tokens):
+            info["score"] = (tokens[i + 1], int(tokens[i + 2]))
+            info["bound"] = "exact"
+            i += 3
+        elif token in ("lowerbound", "upperbound"):
+            info["bound"] = token[:5]
+            i += 1
+        elif token == "pv":
+            info["pv"] = tokens[i + 1:]
+            break
+        elif token == "string":
+            break
+        else:
+            i += 1
+    return info
+
+
+class EngineRequest:
+    ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self.ids)
+        self.cancelled = False
+        self.session = None
+
+    def cancel(self):
+        self.cancelled = True
+        session = self.session
+        if session is not None:
+            session.stop_request(self)
+
+
+def position_command(board):
+    command = f"position fen {board.root().fen()}"
+    if board.move_stack:
+        command += " moves " + " ".join(move.uci() for move in board.move_stack)
+    return command
+
+
+class HubRequest:
+    def __init__(self, key, path, position, go, options=None, timeout=None, new_game=False, daemon="", nice=0,
+                 session="shared", token=None, on_info=None, early_stop=0):
+        self.id = token.id if token is not None else next(EngineRequest.ids)
+        self.key = key
+        self.path = path
+        self.position = position
+        self.go = go
+        self.options = options or {}
+        self.timeout = timeout
+        self.new_game = new_game
+        self.daemon = daemon
+        self.nice = nice
+        self.session = session
+        self.token = token
+        self.on_info = on_info
+        self.early_stop = early_stop
+        self.stable = 0
+        self.cancelled = False
+        self.stopped = False
+        self.retried = False
+        self.hit = False
+        self.searching = False
+        self.done = False
+        self.leader = None
+        self.follower = None
+        self.result = {}
+        self.pending_info = None
+        self.last_info = 0.0
+        self.submitted = time.perf_counter()
+        self.future = concurrent.futures.Future()
+
+    def settle(self, result=None, error=None):
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class AsyncEngine:
+    def __init__(self, hub, path):
+        self.hub = hub
+        self.path = path
+        self.process = None
+        self.name = None
+        self.options = {}
+        self.queue = collections.deque()
+        self.wake = asyncio.Event()
+        self.current = None
+        self.ponder = None
+        self.writer = None
+        self.new_game_pending = False
+        self.task = asyncio.ensure_future(self.run())
+
+    def is_alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self, nice=0):
+        await self.close()
+        with tracer.span("engine.spawn"):
+            self.process = await asyncio.create_subprocess_exec(
+                self.path,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0) | (
+                    getattr(subprocess, "IDLE_PRIORITY_CLASS", 0) if nice else 0),
+            )
+        if nice and hasattr(os, "setpriority"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, self.process.pid, nice)
+            except OSError:
+                pass
+        self.options = {}
+        self.new_game_pending = False
+        with tracer.span("engine.handshake"):
+            await self.send("uci")
+            while True:
+                line = await self.read_line(self.hub.handshake_timeout)
+                if line.startswith("id name "):
+                    self.name = line[8:].strip()
+                elif line.startswith("uciok"):
+                    break
+            await self.wait_ready()
+
+    async def close(self):
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            if process.returncode is None:
+                process.stdin.write(b"quit\n")
+                await asyncio.wait_for(process.wait(), 2)
+        except Exception:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    async def kill(self):
+        process, self.process = self.process, None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    async def send(self, command):
+        try:
+            self.process.stdin.write((command + "\n").encode())
+            await self.process.stdin.drain()
+        except (OSError, AttributeError):
+            raise EngineTerminated(self.path)
+
+    async def read_line(self, timeout=None):
+        try:
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        except (ValueError, AttributeError):
+            raise EngineTerminated(self.path)
+        if not line:
+            raise EngineTerminated(self.path)
+        return line.decode(errors="replace").strip()
+
+    async def wait_ready(self):
+        await self.send("isready")
+        while not (await self.read_line(self.hub.handshake_timeout)).startswith("readyok"):
+            pass
+
+    async def configure(self, options):
+        changed = False
+        for name, value in options.items():
+            if self.options.get(name) != value:
+                await self.send(f"setoption name {name} value {value}")
+                self.options[name] = value
+                changed = True
+        if changed:
+            with tracer.span("engine.setoption"):
+                await self.wait_ready()
+
+    async def stop(self, request):
+        if request is not self.current or request.stopped:
+            return
+        if self.writer is not None:
+            request.stopped = True
+            try:
+                self.writer.write((json.dumps({"op": "cancel", "id": request.id}) + "\n").encode())
+            except OSError:
+                pass
+        elif self.is_alive():
+            request.stopped = True
+            try:
+                await self.send("stop")
+            except EngineTerminated:
+                pass
+
+    async def ponderhit(self, request):
+        if request is self.current and request.searching and self.is_alive():
+            try:
+                await self.send("ponderhit")
+            except EngineTerminated:
+                pass
+
+    async def run(self):
+        while True:
+            while not self.queue:
+                self.wake.clear()
+                await self.wake.wait()
+            request = self.queue.popleft()
+            if request.cancelled:
+                continue
+            self.current = request
+            try:
+                while True:
+                    try:
+                        await self.execute(request)
+                        break
+                    except EngineTerminated:
+                        await self.close()
+                        if request.retried or request.stopped or request.cancelled or request.result:
+                            raise
+                        request.retried = True
+            except EngineTerminated:
+                self.hub.fail(request, "terminated")
+            except asyncio.TimeoutError:
+                await self.kill()
+                self.hub.fail(request, "timeout")
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.hub.fail(request, str(error) or type(error).__name__)
+            finally:
+                self.current = None
+
+    async def execute(self, request):
+        if request.daemon:
+            return await self.execute_daemon(request)
+        if request.go is None:
+            if self.is_alive():
+                await self.configure(request.options)
+            self.hub.finish(request)
+            return
+        if not self.is_alive():
+            await self.start(request.nice)
+        await self.configure(request.options)
+        if self.new_game_pending or request.new_game:
+            await self.send("ucinewgame")
+            await self.wait_ready()
+            self.new_game_pending = False
+        if request.cancelled:
+            return
+        await self.send(request.position)
+        await self.send(request.go)
+        request.searching = True
+        if request.hit and "ponder" in request.go.split():
+            await self.send("ponderhit")
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + request.timeout if request.timeout else None
+        with tracer.span("engine.search"):
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    line = await self.read_line(timeout)
+                except asyncio.TimeoutError:
+                    if request.stopped:
+                        raise
+                    await self.stop(request)
+                    deadline = loop.time() + self.hub.stop_grace
+                    continue
+                if line.startswith("info"):
+                    info = parse_info(line)
+                    if info.get("pv") and info.get("multipv", 1) == 1:
+                        if request.early_stop and info.get("depth", 0) > request.result.get("depth", 0):
+                            same = request.result.get("pv", [None])[0] == info["pv"][0]
+                            request.stable = request.stable + 1 if same else 0
+                            if request.stable >= request.early_stop:
+                                await self.stop(request)
+                        request.result.update(info)
+                        self.hub.info(request, info)
+                elif line.startswith("bestmove"):
+                    tokens = line.split()
+                    request.result["bestmove"] = tokens[1] if len(tokens) > 1 and tokens[1] != "(none)" else None
+                    request.result["ponder"] = tokens[3] if len(tokens) > 3 and tokens[2] == "ponder" else None
+                    self.hub.finish(request)
+                    return
+
+    async def execute_daemon(self, request):
+        try:
+            reader, self.writer = await asyncio.open_unix_connection(request.daemon)
+        except (AttributeError, OSError):
+            raise EngineTerminated(request.daemon)
+        try:
+            self.writer.write((json.dumps({"op": "search", "id": request.id, "client": os.getpid(),
+                                           "position": request.position, "go": request.go,
+                                           "options": request.options, "info": True,
+                                           "early_stop": request.early_stop,
+                                           "new_game": self.new_game_pending or request.new_game}) + "\n").encode())
+            self.new_game_pending = False
+            await self.writer.drain()
+            loop = asyncio.get_event_loop()
+            deadline = loop.time() + request.timeout if request.timeout else None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                except asyncio.TimeoutError:
+                    if request.stopped:
+                        raise
+                    await self.stop(request)
+                    deadline = loop.time() + self.hub.stop_grace
+                    continue
+                if not line:
+                    raise EngineTerminated(request.daemon)
+                message = json.loads(line)
+                for key in ("info", "result"):
+                    if (message.get(key) or {}).get("score"):
+                        message[key]["score"] = tuple(message[key]["score"])
+                if "info" in message:
+                    request.result.update(message["info"])
+                    self.hub.info(request, message["info"])
+                elif "error" in message:
+                    raise EngineTerminated(message["error"])
+                elif "result" in message:
+                    if message["result"] is None:
+                        if request.cancelled:
+                            return
+                        raise asyncio.TimeoutError()
+                    request.result = message["result"]
+                    self.hub.finish(request)
+                    return
+        finally:
+            writer, self.writer = self.writer, None
+            writer.close()
+
+
+class EngineHub(QObject):
+    info_ready = pyqtSignal(int, object)
+    result_ready = pyqtSignal(int, object)
+    request_failed = pyqtSignal(int, str)
+
+    def __init__(self, max_pending=8, info_interval=0.05, handshake_timeout=10, stop_grace=2):
+        super(EngineHub, self).__init__()
+        self.max_pending = max_pending
+        self.info_interval = info_interval
+        self.handshake_timeout = handshake_timeout
+        self.stop_grace = stop_grace
+        self.loop = asyncio.new_event_loop()
+        self.engines = {}
+        self.requests = {}
+        self.thread = threading.Thread(target=self.run_loop, name="engine-hub", daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, function, *args):
+        self.loop.call_soon_threadsafe(function, *args)
+
+    def submit(self, key, path, position, go, options=None, timeout=None, new_game=False, supersede=False,
+               daemon="", nice=0, session="shared", token=None, early_stop=0):
+        request = HubRequest(key, path, position, go, options, timeout, new_game, daemon, nice, session, token,
+                             early_stop=early_stop)
+        return self.post(request, supersede).id
+
+    def search(self, path, position, go, options=None, on_info=None, early_stop=0, request=None, new_game=False,
+               session="shared", timeout=None, daemon=""):
+        hub_request = self.post(HubRequest("search", path, position, go, options, timeout, new_game, daemon,
+                                           session=session, token=request, on_info=on_info, early_stop=early_stop))
+        return hub_request.future.result()
+
+    def post(self, request, supersede=False):
+        if request.token is not None:
+            request.token.session = self
+        self.call(self.enqueue, request, supersede)
+        return request
+
+    def configure(self, path, options, session="shared"):
+        self.post(HubRequest("configure", path, None, None, options, session=session))
+
+    def ponder(self, path, position, go, options=None, session="shared"):
+        request = HubRequest("ponder", path, position, go.replace("go", "go ponder", 1), options, session=session)
+        self.call(self.start_ponder, request)
+
+    def start_ponder(self, request):
+        engine = self.engine(request)
+        self.discard_ponder(engine)
+        engine.ponder = request
+        self.enqueue(request, False)
+
+    def ponderhit(self, position):
+        self.call(self.mark_ponderhit, position)
+
+    def mark_ponderhit(self, position):
+        for engine in self.engines.values():
+            request = engine.ponder
+            if request is None or request.hit:
+                continue
+            if request.position != position or request.cancelled:
+                self.discard_ponder(engine)
+                continue
+            request.hit = True
+            if request is not engine.current:
+                request.go = request.go.replace("go ponder", "go", 1)
+            elif request.searching:
+                asyncio.ensure_future(engine.ponderhit(request))
+
+    def stop_ponder(self):
+        self.call(self.stop_all_ponders)
+
+    def stop_all_ponders(self):
+        for engine in self.engines.values():
+            self.discard_ponder(engine)
+
+    def discard_ponder(self, engine):
+        request, engine.ponder = engine.ponder, None
+        if request is not None and not request.done:
+            self.cancel_request(request)
+
+    def engine(self, request):
+        engine = self.engines.get((request.path, request.session))
+        if engine is None:
+            engine = self.engines[(request.path, request.session)] = AsyncEngine(self, request.path)
+        return engine
+
+    def enqueue(self, request, supersede):
+        if request.token is not None and request.token.cancelled:
+            request.cancelled = True
+            request.settle()
+            return
+        engine = self.engine(request)
+        ponder = engine.ponder
+        if ponder is not None and request is not ponder:
+            engine.ponder = None
+            if ponder.hit and ponder.position == request.position and not ponder.cancelled:
+                self.requests[request.id] = request
+                if ponder.done:
+                    request.result = ponder.result
+                    self.finish(request)
+                else:
+                    ponder.follower = request
+                    request.leader = ponder
+                return
+            if not ponder.done:
+                self.cancel_request(ponder)
+        if supersede:
+            for pending in list(engine.queue):
+                if pending.key == request.key:
+                    self.cancel_request(pending)
+            if engine.current is not None and engine.current.key == request.key:
+                self.cancel_request(engine.current)
+        if len(engine.queue) >= self.max_pending:
+            self.fail(request, "busy")
+            return
+        self.requests[request.id] = request
+        engine.queue.append(request)
+        engine.wake.set()
+
+    def cancel(self, request_id):
+        self.call(self.cancel_by_id, request_id)
+
+    def stop_request(self, request):
+        self.cancel(request.id)
+
+    def cancel_by_id(self, request_id):
+        request = self.requests.get(request_id)
+        if request is not None:
+            self.cancel_request(request)
+
+    def cancel_request(self, request):
+        request.cancelled = True
+        request.settle()
+        self.requests.pop(request.id, None)
+        engine = self.engines.get((request.path, request.session))
+        if engine is None:
+            return
+        leader, request.leader = request.leader, None
+        if leader is not None:
+            leader.follower = None
+            self.cancel_request(leader)
+        if request in engine.queue:
+            engine.queue.remove(request)
+        elif request is engine.current:
+            asyncio.ensure_future(engine.stop(request))
+
+    def info(self, request, info):
+        if request.follower is not None:
+            request = request.follower
+        if request.cancelled:
+            return
+        if request.on_info is not None:
+            try:
+                request.on_info(info)
+            except Exception:
+                pass
+        now = time.perf_counter()
+        if now - request.last_info >= self.info_interval:
+            request.last_info = now
+            request.pending_info = None
+            self.info_ready.emit(request.id, info)
+        else:
+            if request.pending_info is None:
+                self.loop.call_later(self.info_interval, self.flush_info, request)
+            request.pending_info = info
+
+    def flush_info(self, request):
+        info, request.pending_info = request.pending_info, None
+        if info is not None and not request.cancelled:
+            request.last_info = time.perf_counter()
+            self.info_ready.emit(request.id, info)
+
+    def finish(self, request):
+        if request.done:
+            return
+        request.done = True
+        self.requests.pop(request.id, None)
+        if request.go is None:
+            request.settle(request.result)
+            return
+        if request.follower is not None:
+            request.follower.result = request.result
+            self.finish(request.follower)
+            return
+        if request.cancelled:
+            return
+        self.flush_info(request)
+        tracer.record("hub.request", (time.perf_counter() - request.submitted) * 1000)
+        request.settle(request.result)
+        self.result_ready.emit(request.id, request.result)
+
+    def fail(self, request, reason):
+        if request.done:
+            return
+        request.done = True
+        self.requests.pop(request.id, None)
+        if request.follower is not None:
+            self.fail(request.follower, reason)
+            return
+        if not request.cancelled:
+            request.settle(error=EngineTerminated(reason))
+            self.request_failed.emit(request.id, reason)
+
+    def new_game(self):
+        self.call(self.mark_new_game)
+
+    def mark_new_game(self):
+        for engine in self.engines.values():
+            engine.new_game_pending = True
+            self.discard_ponder(engine)
+
+    def engine_name(self, path, session="shared"):
+        engine = self.engines.get((path, session))
+        return engine.name if engine is not None else None
+
+    def close_engines(self, path=None, session=None):
+        future = asyncio.run_coroutine_threadsafe(self.shutdown_engines(path, session), self.loop)
+        try:
+            future.result(5)
+        except Exception:
+            pass
+
+    async def shutdown_engines(self, path=None, session=None):
+        keys = [key for key in self.engines if path is None or key == (path, session)]
+        engines = [self.engines.pop(key) for key in keys]
+        for request in list(self.requests.values()):
+            if (request.path, request.session) in keys:
+                self.fail(request, "closed")
+        for engine in engines:
+            engine.task.cancel()
+            for request in list(engine.queue) + [engine.current, engine.ponder]:
+                if request is not None:
+                    request.cancelled = True
+                    request.settle()
+            await engine.close()
+
+
+engine_hub = None
+engine_hub_lock = threading.Lock()
+
+
+def get_engine_hub():
+    global engine_hub
+    with engine_hub_lock:
+        if engine_hub is None:
+            engine_hub = EngineHub()
+        return engine_hub
+
+
+def close_engine_hub():
+    if engine_hub is not None:
+        engine_hub.close_engines()
+
+
+def engine_new_game():
+    if engine_hub is not None:
+        engine_hub.new_game()
+
+
+def engine_ponderhit(position):
+    if engine_hub is not None:
+        engine_hub.ponderhit(position)
+
+
+def stop_engine_ponder():
+    if engine_hub is not None:
+        engine_hub.stop_ponder()
+
+
+atexit.register(close_engine_hub)
+
+
+def zobrist_key(board):
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def engine_identity(path, options):
+    try:
+        mtime = int(os.path.getmtime(path))
+    except OSError:
+        mtime = 0
+    return "|".join([str(path), str(mtime)] + [f"{name}={value}" for name, value in sorted(options.items())])
+
+
+class EvalCache:
+    def __init__(self, path, max_entries=100000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS evals (hash INTEGER, engine TEXT, depth INTEGER, "
+                          "movetime INTEGER, score_type TEXT, score INTEGER, bound TEXT, pv TEXT, bestmove TEXT, "
+                          "used REAL, PRIMARY KEY (hash, engine))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS evals_used ON evals (used)")
+        self.conn.commit()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM evals").fetchone()[0]
+
+    def get(self, board, engine, depth=None, movetime=None):
+        key = zobrist_key(board)
+        with self.lock, tracer.span("db.eval_cache.get"):
+            row = self.conn.execute("SELECT depth, movetime, score_type, score, bound, pv, bestmove FROM evals "
+                                    "WHERE hash = ? AND engine = ?", (key, engine)).fetchone()
+            if row is None:
+                return None
+            stored_depth, stored_movetime, score_type, score, bound, pv, bestmove = row
+            if not ((depth is not None and stored_depth >= depth) or
+                    (movetime is not None and stored_movetime >= movetime)):
+                return None
+            self.conn.execute("UPDATE evals SET used = ? WHERE hash = ? AND engine = ?", (time.time(), key, engine))
+            self.conn.commit()
+        return {"depth": stored_depth, "score": (score_type, score) if score_type else None, "bound": bound,
+                "pv": pv.split(), "bestmove": bestmove, "ponder": None}
+
+    def put(self, board, engine, result, movetime=0):
+        if not result.get("bestmove"):
+            return
+        score_type, score = result.get("score") or (None, None)
+        key = zobrist_key(board)
+        with self.lock, tracer.span("db.eval_cache.put"):
+            stored = self.conn.execute("SELECT 1 FROM evals WHERE hash = ? AND engine = ?", (key, engine)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, engine, result.get("depth", 0), movetime, score_type, score,
+                 result.get("bound"), " ".join(result.get("pv") or [result["bestmove"]]), result["bestmove"],
+                 time.time()))
+            if stored is None:
+                self.count += 1
+            if self.count > self.max_entries * 1.1:
+                self.conn.execute("DELETE FROM evals WHERE rowid IN (SELECT rowid FROM evals ORDER BY used LIMIT ?)",
+                                  (self.count - self.max_entries,))
+                self.count = self.conn.execute("SELECT COUNT(*) FROM evals").fetchone()[0]
+            self.conn.commit()
+
+
+opening_books = {}
+
+
+def get_opening_book(path):
+    book = opening_books.get(path)
+    if book is None:
+        book = opening_books[path] = chess.polyglot.open_reader(path)
+    return book
+
+
+def book_move(board, book_settings):
+    path = book_settings.get("path")
+    if not path or board.ply() >= book_settings.get("depth(plies)", 16):
+        return None
+    try:
+        reader = get_opening_book(path)
+        if book_settings.get("selection") == "best":
+            return reader.find(board).move
+        return reader.weighted_choice(board).move
+    except (IndexError, OSError, ValueError):
+        return None
+
+
+tablebases = {}
+
+
+def get_tablebase(path):
+    tablebase = tablebases.get(path)
+    if tablebase is None:
+        tablebase = chess.syzygy.Tablebase()
+        for directory in path.split(os.pathsep):
+            if directory:
+                tablebase.add_directory(directory)
+        tablebases[path] = tablebase
+    return tablebase
+
+
+def tablebase_move(board, path):
+    if not path or chess.popcount(board.occupied) > chess.syzygy.TBPIECES or board.castling_rights:
+        return None
+    try:
+        tablebase = get_tablebase(path)
+        tablebase.probe_wdl(board)
+        best = None
+        best_key = None
+        for move in board.legal_moves:
+            board.push(move)
+            try:
+                wdl = -tablebase.probe_wdl(board)
+                dtz = tablebase.probe_dtz(board)
+            finally:
+                board.pop()
+            key = (wdl, -abs(dtz) if wdl > 0 else abs(dtz))
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+        return best
+    except (KeyError, OSError):
+        return None
+
+
+eval_cache = None
+
+
+def get_eval_cache():
+    global eval_cache
+    if eval_cache is None:
+        eval_cache = EvalCache("eval_cache.db")
+    return eval_cache
+
+
+GAME_HEADERS = {"Event": "event", "Site": "site", "Date": "date", "Round": "round", "White": "white",
+                "Black": "black", "Result": "result", "ECO": "eco"}
+
+
+RESULT_COLUMNS = {"1-0": 1, "1/2-1/2": 2, "0-1": 3}
+GAME_INDEXES = ("positions", "move_stats")
+
+
+def move_code(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def code_move(code):
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+def encode_moves(moves):
+    return struct.pack(f"<{len(moves)}H", *(move_code(move) for move in moves))
+
+
+def decode_moves(data):
+    return [code_move(code) for code in struct.unpack(f"<{len(data) // 2}H", data)]
+
+
+class GameStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.backfill = {}
+        self.backfill_thread = None
+        self.create_schema()
+
+    def create_schema(self):
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, fen TEXT, moves TEXT)")
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(games)")}
+            for column, column_type in [("event", "TEXT"), ("site", "TEXT"), ("date", "TEXT"), ("round", "TEXT"),
+                                        ("white", "TEXT"), ("black", "TEXT"), ("result", "TEXT"), ("eco", "TEXT"),
+                                        ("start_fen", "TEXT"), ("ply_count", "INTEGER"), ("move_data", "BLOB")]:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE games ADD COLUMN {column} {column_type}")
+            for column in ("white", "black", "date", "eco"):
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS games_{column} ON games ({column})")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, size INTEGER, "
+                              "offset INTEGER)")
+            tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            self.conn.execute("CREATE TABLE IF NOT EXISTS positions (hash INTEGER, game_id INTEGER, ply INTEGER, "
+                              "PRIMARY KEY (hash, game_id, ply)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS move_stats (hash INTEGER, move INTEGER, games INTEGER, "
+                              "white_wins INTEGER, draws INTEGER, black_wins INTEGER, "
+                              "PRIMARY KEY (hash, move)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS backfill (name TEXT PRIMARY KEY, next_id INTEGER, "
+                              "end_id INTEGER)")
+            last_id = self.conn.execute("SELECT MAX(id) FROM games").fetchone()[0] or 0
+            for name in GAME_INDEXES:
+                if name not in tables and last_id:
+                    self.conn.execute("INSERT OR REPLACE INTO backfill VALUES (?, 1, ?)", (name, last_id))
+            self.backfill = {name: [next_id, end_id] for name, next_id, end_id in
+                             self.conn.execute("SELECT name, next_id, end_id FROM backfill")}
+        self.start_backfill()
+
+    def start_backfill(self):
+        with self.lock:
+            if self.backfill and self.backfill_thread is None:
+                self.backfill_thread = threading.Thread(target=self.run_backfill, daemon=True)
+                self.backfill_thread.start()
+
+    def run_backfill(self, chunk_size=25):
+        try:
+            while self.backfill_chunk(chunk_size):
+                time.sleep(0)
+        finally:
+            with self.lock:
+                self.backfill_thread = None
+
+    def backfill_chunk(self, chunk_size):
+        with self.lock, tracer.span("db.backfill"), self.conn:
+            name = next((name for name in GAME_INDEXES if name in self.backfill), None)
+            if name is None:
+                return False
+            next_id, end_id = self.backfill[name]
+            game_ids = [row[0] for row in self.conn.execute(
+                "SELECT id FROM games WHERE id >= ? AND id <= ? ORDER BY id LIMIT ?",
+                (next_id, end_id, chunk_size))]
+            prepared = {}
+            for game_id in game_ids:
+                try:
+                    prepared[game_id] = self.prepare_game(self.get_game(game_id))
+                except ValueError:
+                    continue
+            if name == "positions":
+                for game_id, game in prepared.items():
+                    self.insert_positions(game_id, game["positions"])
+            else:
+                self.update_stats(prepared.values())
+            next_id = game_ids[-1] + 1 if len(game_ids) == chunk_size else end_id + 1
+            if next_id > end_id:
+                self.conn.execute("DELETE FROM backfill WHERE name = ?", (name,))
+                del self.backfill[name]
+            else:
+                self.conn.execute("UPDATE backfill SET next_id = ? WHERE name = ?", (next_id, name))
+                self.backfill[name][0] = next_id
+            return True
+
+    def indexed(self, name, game_id):
+        bounds = self.backfill.get(name)
+        return bounds is None or not bounds[0] <= game_id <= bounds[1]
+
+    def index_progress(self, name):
+        bounds = self.backfill.get(name)
+        return None if bounds is None else (bounds[0] - 1) / bounds[1]
+
+    def insert_positions(self, game_id, positions):
+        self.conn.executemany("INSERT OR IGNORE INTO positions VALUES (?, ?, ?)",
+                              [(key, game_id, ply) for ply, key in enumerate(positions)])
+
+    @staticmethod
+    def prepare_game(game):
+        headers = game.get("headers", {})
+        board = chess.Board(game["start_fen"])
+        positions = [zobrist_key(board)]
+        for move in game["moves"]:
+            if move and not board.is_pseudo_legal(move):
+                break
+            board.push(move)
+            positions.append(zobrist_key(board))
+        played = game["moves"][:len(positions) - 1]
+        row = [board.fen(), game["start_fen"], len(game["moves"]), encode_moves(game["moves"])] + [
+            headers.get(header) for header in GAME_HEADERS]
+        return {"row": row, "positions": positions, "result": headers.get("Result"),
+                "continuations": set(zip(positions, map(move_code, played)))}
+
+    def update_stats(self, prepared, sign=1):
+        stats = collections.defaultdict(lambda: [0, 0, 0, 0])
+        for game in prepared:
+            column = RESULT_COLUMNS.get(game["result"])
+            for key in game["continuations"]:
+                entry = stats[key]
+                entry[0] += sign
+                if column:
+                    entry[column] += sign
+        self.conn.executemany("INSERT INTO move_stats VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (hash, move) DO UPDATE "
+                              "SET games = games + excluded.games, white_wins = white_wins + excluded.white_wins, "
+                              "draws = draws + excluded.draws, black_wins = black_wins + excluded.black_wins",
+                              [key + tuple(entry) for key, entry in stats.items()])
+        if sign < 0:
+            self.conn.executemany("DELETE FROM move_stats WHERE hash = ? AND move = ? AND games <= 0", list(stats))
+
+    def add_prepared(self, prepared, import_state=None):
+        columns = ", ".join(["fen", "start_fen", "ply_count", "move_data"] + list(GAME_HEADERS.values()))
+        placeholders = ", ".join("?" * (4 + len(GAME_HEADERS)))
+        with self.lock, tracer.span("db.insert_games"), self.conn:
+            first_id = (self.conn.execute("SELECT MAX(id) FROM games").fetchone()[0] or 0) + 1
+            self.conn.executemany(f"INSERT INTO games (id, {columns}) VALUES (?, {placeholders})",
+                                  [[first_id + i] + game["row"] for i, game in enumerate(prepared)])
+            for i, game in enumerate(prepared):
+                self.insert_positions(first_id + i, game["positions"])
+            self.update_stats(prepared)
+            if import_state is not None:
+                self.conn.execute("INSERT OR REPLACE INTO imports VALUES (?, ?, ?)", import_state)
+        return list(range(first_id, first_id + len(prepared)))
+
+    def add_games(self, games):
+        return self.add_prepared([self.prepare_game(game) for game in games])
+
+    def add_game(self, game):
+        return self.add_games([game])[0]
+
+    def update_game(self, game_id, game):
+        prepared = self.prepare_game(game)
+        assignments = ", ".join(f"{column} = ?" for column in
+                                ["fen", "start_fen", "ply_count", "move_data"] + list(GAME_HEADERS.values()))
+        with self.lock, tracer.span("db.update_game"), self.conn:
+            old_game = self.get_game(game_id)
+            if old_game is not None:
+                old_prepared = self.prepare_game(old_game)
+                if self.indexed("positions", game_id):
+                    self.conn.executemany("DELETE FROM positions WHERE hash = ? AND game_id = ?",
+                                          [(key, game_id) for key in set(old_prepared["positions"])])
+                if self.indexed("move_stats", game_id):
+                    self.update_stats([old_prepared], -1)
+            self.conn.execute(f"UPDATE games SET {assignments}, moves = NULL WHERE id = ?",
+                              prepared["row"] + [game_id])
+            if self.indexed("positions", game_id):
+                self.insert_positions(game_id, prepared["positions"])
+            if self.indexed("move_stats", game_id):
+                self.update_stats([prepared])
+
+    def explore(self, board):
+        key = zobrist_key(board)
+        with self.lock, tracer.span("db.explore"):
+            rows = self.conn.execute("SELECT move, games, white_wins, draws, black_wins FROM move_stats "
+                                     "WHERE hash = ? ORDER BY games DESC", (key,)).fetchall()
+            if "move_stats" in self.backfill:
+                rows = self.merge_pending_stats(key, rows, *self.backfill["move_stats"])
+        return [(code_move(code),) + tuple(counts) for code, *counts in rows]
+
+    def merge_pending_stats(self, key, rows, next_id, end_id):
+        continuations = set()
+        for game_id, ply, move_data, moves, result in self.conn.execute(
+                "SELECT p.game_id, p.ply, g.move_data, g.moves, g.result FROM positions p "
+                "JOIN games g ON g.id = p.game_id WHERE p.hash = ? AND p.game_id >= ? AND p.game_id <= ?",
+                (key, next_id, end_id)):
+            if move_data is not None:
+                if 2 * ply < len(move_data):
+                    continuations.add((game_id, struct.unpack_from("<H", move_data, 2 * ply)[0], result))
+            else:
+                moves = (moves or "").split()
+                if ply < len(moves):
+                    continuations.add((game_id, move_code(chess.Move.from_uci(moves[ply])), result))
+        stats = {code: list(counts) for code, *counts in rows}
+        for game_id, code, result in continuations:
+            entry = stats.setdefault(code, [0, 0, 0, 0])
+            entry[0] += 1
+            if RESULT_COLUMNS.get(result):
+                entry[RESULT_COLUMNS[result]] += 1
+        return sorted(([code] + entry for code, entry in stats.items()), key=lambda row: -row[1])
+
+    def find_position(self, board, limit=500):
+        with self.lock, tracer.span("db.find_position"):
+            return self.conn.execute("SELECT p.game_id, p.ply, g.white, g.black, g.result, g.date "
+                                     "FROM positions p JOIN games g ON g.id = p.game_id "
+                                     "WHERE p.hash = ? ORDER BY p.game_id LIMIT ?",
+                                     (zobrist_key(board), limit)).fetchall()
+
+    def get_game(self, game_id):
+        with self.lock, tracer.span("db.get_game"):
+            row = self.conn.execute(f"SELECT start_fen, move_data, moves, {', '.join(GAME_HEADERS.values())} "
+                                    f"FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        start_fen, move_data, moves = row[:3]
+        if move_data is not None:
+            moves = decode_moves(move_data)
+        else:
+            moves = [chess.Move.from_uci(move) for move in (moves or "").split()]
+        headers = {header: value for header, value in zip(GAME_HEADERS, row[3:]) if value is not None}
+        return {"id": game_id, "headers": headers, "start_fen": start_fen or chess.STARTING_FEN, "moves": moves}
+
+    def page(self, after_id=0, limit=200, player=""):
+        query = "SELECT id, white, black, result, date, eco, event, ply_count FROM games WHERE id > ?"
+        parameters = [after_id]
+        if player:
+            query += " AND (white LIKE ? OR black LIKE ?)"
+            parameters += [player + "%", player + "%"]
+        with self.lock:
+            return self.conn.execute(query + " ORDER BY id LIMIT ?", parameters + [limit]).fetchall()
+
+    def import_offset(self, path, size):
+        with self.lock:
+            row = self.conn.execute("SELECT offset FROM imports WHERE path = ?", (path,)).fetchone()
+        return row[0] if row and row[0] <= size else 0
+
+
+def is_pgn_tag_pair(stripped):
+    return stripped[:1] == b"[" and stripped[1:2].isalnum() and stripped.endswith(b'"]')
+
+
+def read_pgn_games(f, offset):
+    lines = []
+    in_moves = False
+    boundary = True
+    for line in f:
+        stripped = line.strip()
+        if in_moves and boundary and is_pgn_tag_pair(stripped):
+            yield offset, b"".join(lines)
+            lines = []
+            in_moves = False
+        elif stripped and not stripped.startswith((b"[", b"%")):
+            in_moves = True
+        boundary = not stripped or stripped.endswith((b"1-0", b"0-1", b"1/2-1/2", b"*"))
+        lines.append(line)
+        offset += len(line)
+    if in_moves:
+        yield offset, b"".join(lines)
+
+
+def read_pgn_batches(f, offset, batch_size):
+    batch = []
+    end = offset
+    for end, text in read_pgn_games(f, offset):
+        batch.append(text)
+        if len(batch) >= batch_size:
+            yield end, batch
+            batch = []
+    if batch:
+        yield end, batch
+
+
+def parse_pgn_batch(texts):
+    prepared = []
+    for text in texts:
+        try:
+            game = chess.pgn.read_game(io.StringIO(text.decode("utf-8", errors="replace")))
+            if game is None:
+                continue
+            prepared.append(GameStore.prepare_game({"headers": dict(game.headers), "start_fen": game.board().fen(),
+                                                    "moves": list(game.mainline_moves())}))
+        except ValueError:
+            continue
+    return prepared
+
+
+def import_pgn(store, pgn_path, batch_size=1000, workers=None, progress=None, cancelled=None):
+    pgn_path = os.path.abspath(pgn_path)
+    size = os.path.getsize(pgn_path)
+    offset = store.import_offset(pgn_path, size)
+    workers = workers or os.cpu_count() or 1
+    imported = 0
+    pending = collections.deque()
+    with open(pgn_path, "rb") as f, concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        f.seek(offset)
+        batches = read_pgn_batches(f, offset, batch_size)
+        while True:
+            if cancelled is not None and cancelled():
+                for _, future in pending:
+                    future.cancel()
+                break
+            if len(pending) < 2 * workers:
+                batch = next(batches, None)
+                if batch is not None:
+                    end, texts = batch
+                    pending.append((end, pool.submit(parse_pgn_batch, texts)))
+                    continue
+            if not pending:
+                break
+            end, future = pending.popleft()
+            imported += len(store.add_prepared(future.result(), (pgn_path, size, end)))
+            if progress is not None:
+                progress(end, size, imported)
+    return imported
+
+
+game_stores = {}
+game_stores_lock = threading.Lock()
+
+
+def get_game_store(path):
+    path = os.path.abspath(path)
+    with game_stores_lock:
+        store = game_stores.get(path)
+        if store is None:
+            store = game_stores[path] = GameStore(path)
+        return store
+
+
 class SettingsDialog(QDialog):
+    engines_scanned = pyqtSignal(list)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle('Settings')
-        self.setGeometry(600, 300, 450, 400)
+        self.setGeometry(600, 300, 450, 880)
         layout = QVBoxLayout()
 
         self.skill_level_edit = QLineEdit()
@@ -62,17 +1618,53 @@ class SettingsDialog(QDialog):
         self.bot_move_time_edit = QLineEdit()
         self.bot_move_time_edit.setPlaceholderText('move time')
         self.bot_move_time_label = QLabel('bot move time')
+        self.bot_ponder_checkbox = QCheckBox("bot thinks on your time (ponder)")
+        self.bot_early_stop_edit = QLineEdit()
+        self.bot_early_stop_edit.setPlaceholderText('early stop')
+        self.bot_early_stop_label = QLabel('stop when the best move is stable for N iterations (0 = off)')
+        self.clock_checkbox = QCheckBox('play with clocks (bot uses wtime/btime instead of move time)')
+        self.clock_base_edit = QLineEdit()
+        self.clock_base_edit.setPlaceholderText('base')
+        self.clock_increment_edit = QLineEdit()
+        self.clock_increment_edit.setPlaceholderText('increment')
+        self.clock_label = QLabel('clock base (s) / increment (s)')
         self.engine_path_edit = QLineEdit()
         self.engine_path_edit.setPlaceholderText('engine path')
         self.engine_path_label = QLabel('engine path')
-
-        try:
-            data = json.load(open("settings.json"))
-        except Exception:
-            data = {
-                "analyse": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128, "analyse time": 3000},
-                "bot": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128, "move time": 3000},
-                "engine(stockfish)": {"path": "C:/PYTHON/ChessQT/stockfish/stockfish-windows-x86-64-avx2.exe"}}
+        self.engine_combo = QComboBox()
+        self.engine_combo.activated.connect(self.select_engine)
+        self.engines_scanned.connect(self.show_engines)
+        self.engine_dirs_edit = QLineEdit()
+        self.engine_dirs_edit.setPlaceholderText('engine folders')
+        self.engine_dirs_label = QLabel(f'extra engine folders (separated by "{os.pathsep}")')
+        self.rescan_button = QPushButton('Rescan engines')
+        self.rescan_button.clicked.connect(lambda: self.fill_engines(force=True))
+        self.game_analysis_checkbox = QCheckBox('analyse the whole game in the background')
+        self.game_analysis_label = QLabel('background analysis depth / threads')
+        self.game_analysis_depth_edit = QLineEdit()
+        self.game_analysis_depth_edit.setPlaceholderText('depth')
+        self.game_analysis_threads_edit = QLineEdit()
+        self.game_analysis_threads_edit.setPlaceholderText('threads')
+        self.daemon_socket_edit = QLineEdit()
+        self.daemon_socket_edit.setPlaceholderText('engine daemon socket')
+        self.daemon_socket_label = QLabel('engine daemon socket (engine_daemon.py, empty to run engines locally)')
+        self.book_path_edit = QLineEdit()
+        self.book_path_edit.setPlaceholderText('opening book')
+        self.book_path_label = QLabel('opening book (polyglot .bin, empty to disable)')
+        self.book_depth_edit = QLineEdit()
+        self.book_depth_edit.setPlaceholderText('book depth')
+        self.book_depth_label = QLabel('book depth (plies)')
+        self.book_selection_combo = QComboBox()
+        self.book_selection_combo.addItems(["weighted", "best"])
+        self.syzygy_path_edit = QLineEdit()
+        self.syzygy_path_edit.setPlaceholderText('syzygy tablebases')
+        self.syzygy_path_label = QLabel('syzygy tablebase folder (empty to disable)')
+        self.metrics_checkbox = QCheckBox('record latency metrics')
+        self.metrics_path_edit = QLineEdit()
+        self.metrics_path_edit.setPlaceholderText('metrics.prom')
+        self.metrics_path_label = QLabel('metrics export on exit (.prom or .json, empty to disable)')
+
+        data = settings.snapshot()
         self.skill_level_edit.setText(str(data["analyse"]["skill level(min=1, max=20)"]))
         self.hash_edit.setText(str(data["analyse"]["hash(mb)"]))
         self.threads_edit.setText(str(data["analyse"]["threads"]))
@@ -81,7 +1673,24 @@ class SettingsDialog(QDialog):
         self.bot_hash_edit.setText(str(data["bot"]["hash(mb)"]))
         self.bot_threads_edit.setText(str(data["bot"]["threads"]))
         self.bot_move_time_edit.setText(str(data["bot"]["move time"]))
+        self.bot_ponder_checkbox.setChecked(data["bot"]["ponder"])
+        self.bot_early_stop_edit.setText(str(data["bot"]["early stop(iterations)"]))
+        self.clock_checkbox.setChecked(data["clock"]["enabled"])
+        self.clock_base_edit.setText(str(data["clock"]["base(s)"]))
+        self.clock_increment_edit.setText(str(data["clock"]["increment(s)"]))
+        self.game_analysis_checkbox.setChecked(data["game analysis"]["enabled"])
+        self.game_analysis_depth_edit.setText(str(data["game analysis"]["depth"]))
+        self.game_analysis_threads_edit.setText(str(data["game analysis"]["threads"]))
         self.engine_path_edit.setText(data["engine(stockfish)"]["path"])
+        self.engine_dirs_edit.setText(data["engine(stockfish)"]["dirs"])
+        self.fill_engines()
+        self.daemon_socket_edit.setText(data["engine(stockfish)"]["daemon socket"])
+        self.book_path_edit.setText(data["book"]["path"])
+        self.book_depth_edit.setText(str(data["book"]["depth(plies)"]))
+        self.book_selection_combo.setCurrentText(data["book"]["selection"])
+        self.syzygy_path_edit.setText(data["syzygy"]["path"])
+        self.metrics_checkbox.setChecked(data["metrics"]["enabled"])
+        self.metrics_path_edit.setText(data["metrics"]["export path"])
 
         ok_button = QPushButton('OK')
         ok_button.clicked.connect(self.accept)
@@ -109,13 +1718,83 @@ class SettingsDialog(QDialog):
 
         layout.addWidget(self.bot_move_time_label)
         layout.addWidget(self.bot_move_time_edit)
+        layout.addWidget(self.bot_ponder_checkbox)
+        layout.addWidget(self.bot_early_stop_label)
+        layout.addWidget(self.bot_early_stop_edit)
+
+        layout.addWidget(self.clock_checkbox)
+        layout.addWidget(self.clock_label)
+        clock_layout = QHBoxLayout()
+        clock_layout.addWidget(self.clock_base_edit)
+        clock_layout.addWidget(self.clock_increment_edit)
+        layout.addLayout(clock_layout)
+
+        layout.addWidget(self.game_analysis_checkbox)
+        layout.addWidget(self.game_analysis_label)
+        game_analysis_layout = QHBoxLayout()
+        game_analysis_layout.addWidget(self.game_analysis_depth_edit)
+        game_analysis_layout.addWidget(self.game_analysis_threads_edit)
+        layout.addLayout(game_analysis_layout)
 
         layout.addWidget(self.engine_path_label)
+        layout.addWidget(self.engine_combo)
         layout.addWidget(self.engine_path_edit)
+        layout.addWidget(self.engine_dirs_label)
+        engine_dirs_layout = QHBoxLayout()
+        engine_dirs_layout.addWidget(self.engine_dirs_edit)
+        engine_dirs_layout.addWidget(self.rescan_button)
+        layout.addLayout(engine_dirs_layout)
+        layout.addWidget(self.daemon_socket_label)
+        layout.addWidget(self.daemon_socket_edit)
+
+        layout.addWidget(self.book_path_label)
+        layout.addWidget(self.book_path_edit)
+        layout.addWidget(self.book_depth_label)
+        layout.addWidget(self.book_depth_edit)
+        layout.addWidget(self.book_selection_combo)
+
+        layout.addWidget(self.syzygy_path_label)
+        layout.addWidget(self.syzygy_path_edit)
+
+        layout.addWidget(self.metrics_checkbox)
+        layout.addWidget(self.metrics_path_label)
+        layout.addWidget(self.metrics_path_edit)
         layout.addWidget(ok_button)
 
         self.setLayout(layout)
 
+    def engine_dirs(self):
+        return [directory for directory in self.engine_dirs_edit.text().split(os.pathsep) if directory.strip()]
+
+    def fill_engines(self, force=False):
+        registry = get_engine_registry()
+        self.show_engines([] if force else registry.engines(), scanning=True)
+        threading.Thread(target=self.scan_engines, args=(registry, self.engine_dirs(), force), daemon=True).start()
+
+    def scan_engines(self, registry, dirs, force):
+        engines = registry.scan(dirs, force=force)
+        try:
+            self.engines_scanned.emit(engines)
+        except RuntimeError:
+            pass
+
+    def show_engines(self, engines, scanning=False):
+        self.rescan_button.setDisabled(scanning)
+        self.engine_combo.clear()
+        if scanning:
+            self.engine_combo.addItem('scanning for engines...', None)
+        else:
+            self.engine_combo.addItem('found engines...' if engines else 'no engines found', None)
+        for name, path in engines:
+            self.engine_combo.addItem(f"{name}  ({path})", path)
+            if path == self.engine_path_edit.text():
+                self.engine_combo.setCurrentIndex(self.engine_combo.count() - 1)
+
+    def select_engine(self, index):
+        path = self.engine_combo.itemData(index)
+        if path:
+            self.engine_path_edit.setText(path)
+
     def get_settings(self):
         settings = {
             "analyse": {
@@ -130,15 +1809,346 @@ class SettingsDialog(QDialog):
                     self.bot_skill_level_edit.text() if self.bot_skill_level_edit.text().isdigit() else 20),
                 "hash(mb)": int(self.bot_hash_edit.text() if self.bot_hash_edit.text() else 1024),
                 "threads": int(self.bot_threads_edit.text() if self.bot_threads_edit.text().isdigit() else 128),
-                "move time": int(self.bot_move_time_edit.text() if self.bot_move_time_edit.text().isdigit() else 3)
+                "move time": int(self.bot_move_time_edit.text() if self.bot_move_time_edit.text().isdigit() else 3),
+                "ponder": self.bot_ponder_checkbox.isChecked(),
+                "early stop(iterations)": int(
+                    self.bot_early_stop_edit.text() if self.bot_early_stop_edit.text().isdigit() else 0)
+            },
+            "clock": {
+                "enabled": self.clock_checkbox.isChecked(),
+                "base(s)": int(self.clock_base_edit.text() if self.clock_base_edit.text().isdigit() else 300),
+                "increment(s)": int(
+                    self.clock_increment_edit.text() if self.clock_increment_edit.text().isdigit() else 2)
+            },
+            "game analysis": {
+                "enabled": self.game_analysis_checkbox.isChecked(),
+                "depth": int(
+                    self.game_analysis_depth_edit.text() if self.game_analysis_depth_edit.text().isdigit() else 12),
+                "threads": int(
+                    self.game_analysis_threads_edit.text() if self.game_analysis_threads_edit.text().isdigit() else 1)
             },
             "engine(stockfish)": {
-                "path": self.engine_path_edit.text()
+                "path": self.engine_path_edit.text(),
+                "dirs": os.pathsep.join(self.engine_dirs()),
+                "daemon socket": self.daemon_socket_edit.text()
+            },
+            "book": {
+                "path": self.book_path_edit.text(),
+                "depth(plies)": int(self.book_depth_edit.text() if self.book_depth_edit.text().isdigit() else 16),
+                "selection": self.book_selection_combo.currentText()
+            },
+            "syzygy": {
+                "path": self.syzygy_path_edit.text()
+            },
+            "metrics": {
+                "enabled": self.metrics_checkbox.isChecked(),
+                "export path": self.metrics_path_edit.text()
             }
         }
         return settings
 
 
+def svg_color(color):
+    color = color.lstrip("#")
+    if len(color) in (3, 4):
+        color = "".join(c * 2 for c in color)
+    qcolor = QColor("#" + color[:6])
+    if len(color) == 8:
+        qcolor.setAlpha(int(color[6:], 16))
+    return qcolor
+
+
+class BoardRenderer:
+    def __init__(self, size, coordinates=True):
+        self.size = size
+        self.coordinates = coordinates
+        margin = 15 if coordinates else 0
+        scale = size / (8 * svg.SQUARE_SIZE + 2 * margin)
+        self.offset = margin * scale
+        self.square_size = svg.SQUARE_SIZE * scale
+        self.board_layer = None
+        self.piece_pixmaps = {}
+        self.colors = {name: svg_color(value) for name, value in svg.DEFAULT_COLORS.items()}
+
+    def square_rect(self, square):
+        return QRectF(self.offset + chess.square_file(square) * self.square_size,
+                      self.offset + (7 - chess.square_rank(square)) * self.square_size,
+                      self.square_size, self.square_size)
+
+    def square_center(self, square):
+        return self.square_rect(square).center()
+
+    def square_at(self, x, y):
+        file_index = math.floor((x - self.offset) / self.square_size)
+        rank_index = 7 - math.floor((y - self.offset) / self.square_size)
+        if 0 <= file_index <= 7 and 0 <= rank_index <= 7:
+            return chess.square(file_index, rank_index)
+        return None
+
+    def arrow_rect(self, arrow):
+        tail, head, _ = arrow
+        return self.square_rect(tail).united(self.square_rect(head)).toAlignedRect()
+
+    def get_board_layer(self):
+        if self.board_layer is None:
+            self.board_layer = QPixmap(self.size, self.size)
+            self.board_layer.fill(Qt.transparent)
+            painter = QPainter(self.board_layer)
+            QSvgRenderer(QByteArray(svg.board(None, coordinates=self.coordinates).encode())).render(
+                painter, QRectF(0, 0, self.size, self.size))
+            painter.end()
+        return self.board_layer
+
+    def piece_pixmap(self, symbol):
+        pixmap = self.piece_pixmaps.get(symbol)
+        if pixmap is None:
+            side = math.ceil(self.square_size)
+            pixmap = QPixmap(side, side)
+            pixmap.fill(Qt.transparent)
+            painter = QPainter(pixmap)
+            QSvgRenderer(QByteArray(svg.piece(chess.Piece.from_symbol(symbol)).encode())).render(
+                painter, QRectF(0, 0, side, side))
+            painter.end()
+            self.piece_pixmaps[symbol] = pixmap
+        return pixmap
+
+    @staticmethod
+    def square_states(board, fill=None, check=None, lastmove=None):
+        fill = fill or {}
+        lastmove_squares = (lastmove.from_square, lastmove.to_square) if lastmove else ()
+        states = []
+        for square in chess.SQUARES:
+            piece = board.piece_at(square)
+            states.append((piece.symbol() if piece else None, fill.get(square), square == check,
+                           square in lastmove_squares))
+        return states
+
+    @staticmethod
+    def arrow_states(arrows):
+        return tuple((arrow.tail, arrow.head, arrow.color) for arrow in arrows)
+
+    def paint_square(self, painter, square, state):
+        symbol, fill_color, check, lastmove = state
+        rect = self.square_rect(square)
+        if lastmove:
+            shade = "light" if chess.BB_LIGHT_SQUARES & chess.BB_SQUARES[square] else "dark"
+            painter.fillRect(rect, self.colors[f"square {shade} lastmove"])
+        if fill_color:
+            painter.fillRect(rect, svg_color(fill_color))
+        if check:
+            gradient = QRadialGradient(rect.center(), rect.width() / 2)
+            gradient.setColorAt(0.0, QColor(255, 0, 0, 255))
+            gradient.setColorAt(0.5, QColor(231, 0, 0, 255))
+            gradient.setColorAt(1.0, QColor(158, 0, 0, 0))
+            painter.fillRect(rect, gradient)
+        if symbol:
+            pixmap = self.piece_pixmap(symbol)
+            painter.drawPixmap(rect, pixmap, QRectF(pixmap.rect()))
+
+    def paint_arrow(self, painter, arrow):
+        tail, head, color = arrow
+        qcolor = self.colors.get(f"arrow {color}") or svg_color(color)
+        start = self.square_center(tail)
+        end = self.square_center(head)
+        if tail == head:
+            painter.setPen(QPen(qcolor, self.square_size * 0.1))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawEllipse(end, self.square_size * 0.45, self.square_size * 0.45)
+            return
+        marker_size = 0.75 * self.square_size
+        marker_margin = 0.1 * self.square_size
+        dx, dy = end.x() - start.x(), end.y() - start.y()
+        hypot = math.hypot(dx, dy)
+        shaft = QPointF(end.x() - dx * (marker_size + marker_margin) / hypot,
+                        end.y() - dy * (marker_size + marker_margin) / hypot)
+        tip = QPointF(end.x() - dx * marker_margin / hypot, end.y() - dy * marker_margin / hypot)
+        painter.setPen(QPen(qcolor, self.square_size * 0.2, Qt.SolidLine, Qt.FlatCap))
+        painter.drawLine(start, shaft)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(qcolor)
+        painter.drawPolygon(QPolygonF([
+            tip,
+            QPointF(shaft.x() + dy * 0.5 * marker_size / hypot, shaft.y() - dx * 0.5 * marker_size / hypot),
+            QPointF(shaft.x() - dy * 0.5 * marker_size / hypot, shaft.y() + dx * 0.5 * marker_size / hypot)]))
+
+    def paint(self, painter, states, arrows, clip=None):
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        if clip is None:
+            painter.drawPixmap(0, 0, self.get_board_layer())
+        else:
+            painter.drawPixmap(clip, self.get_board_layer(), clip)
+        for square, state in enumerate(states):
+            if any(state) and (clip is None or self.square_rect(square).intersects(QRectF(clip))):
+                self.paint_square(painter, square, state)
+        for arrow in arrows:
+            self.paint_arrow(painter, arrow)
+
+    def render(self, board, fill=None, arrows=(), check=None, lastmove=None):
+        pixmap = QPixmap(self.size, self.size)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        self.paint(painter, self.square_states(board, fill, check, lastmove), self.arrow_states(arrows))
+        painter.end()
+        return pixmap
+
+
+class BoardView(QWidget):
+    def __init__(self, parent=None, size=400):
+        super(BoardView, self).__init__(parent)
+        self.setFixedSize(size, size)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.renderer = BoardRenderer(size)
+        self.states = [(None, None, False, False)] * 64
+        self.arrows = ()
+
+    def set_position(self, board, fill=None, arrows=(), check=None, lastmove=None):
+        states = self.renderer.square_states(board, fill, check, lastmove)
+        arrows = self.renderer.arrow_states(arrows)
+        for square in chess.SQUARES:
+            if states[square] != self.states[square]:
+                self.update(self.renderer.square_rect(square).toAlignedRect())
+        if arrows != self.arrows:
+            for arrow in set(arrows) ^ set(self.arrows):
+                self.update(self.renderer.arrow_rect(arrow))
+        self.states = states
+        self.arrows = arrows
+
+    def square_at(self, pos):
+        return self.renderer.square_at(pos.x(), pos.y())
+
+    def paintEvent(self, event):
+        with tracer.span("paint"):
+            painter = QPainter(self)
+            self.renderer.paint(painter, self.states, self.arrows, event.rect())
+            painter.end()
+
+
+class SessionStore:
+    def __init__(self, path="set.json", journal_path="set.journal", compact_after=256, delay=500):
+        self.path = path
+        self.journal_path = journal_path
+        self.compact_after = compact_after
+        self.start_fen = chess.STARTING_FEN
+        self.moves = []
+        self.generation = 0
+        self.journal_lines = 0
+        self.board = None
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.start_fen = data["start fen"]
+            self.moves = list(data["move history"])
+            self.generation = data.get("generation", 0)
+        except Exception:
+            self.start_fen = chess.STARTING_FEN
+            self.moves = []
+            self.generation = 0
+        try:
+            with open(self.journal_path, "r") as f:
+                lines = f.readlines()
+        except OSError:
+            lines = []
+        if lines and lines[0] == f"base {self.generation}\n":
+            for line in lines[1:]:
+                if not line.endswith("\n"):
+                    try:
+                        self.compact()
+                    except OSError:
+                        pass
+                    break
+                command, _, argument = line[:-1].partition(" ")
+                if command == "start":
+                    self.start_fen = argument
+                    self.moves = []
+                elif command == "push":
+                    self.moves.append(argument)
+                elif command == "pop" and self.moves:
+                    self.moves.pop()
+                self.journal_lines += 1
+        else:
+            self.reset_journal()
+        return self.start_fen, list(self.moves)
+
+    def record(self, board):
+        self.board = board
+        self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+        if self.board is None:
+            return
+        start_fen = self.board.root().fen()
+        moves = [move.uci() for move in self.board.move_stack]
+        self.board = None
+        lines = []
+        if start_fen != self.start_fen:
+            lines.append(f"start {start_fen}")
+            common = 0
+        else:
+            common = 0
+            limit = min(len(moves), len(self.moves))
+            while common < limit and moves[common] == self.moves[common]:
+                common += 1
+            lines.extend(["pop"] * (len(self.moves) - common))
+        lines.extend(f"push {move}" for move in moves[common:])
+        self.start_fen = start_fen
+        self.moves = moves
+        if not lines:
+            return
+        try:
+            with tracer.span("persist"):
+                self.write_journal(lines)
+        except OSError:
+            pass
+
+    def write_journal(self, lines):
+        if self.journal_lines + len(lines) > self.compact_after:
+            self.compact()
+        else:
+            with open(self.journal_path, "a") as f:
+                f.write("".join(line + "\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_lines += len(lines)
+
+    def compact(self):
+        try:
+            board = chess.Board(self.start_fen)
+            for move in self.moves:
+                board.push_uci(move)
+            last_fen = board.fen()
+        except ValueError:
+            last_fen = self.start_fen
+        data = {"last fen": last_fen, "move history": self.moves, "start fen": self.start_fen,
+                "generation": self.generation + 1}
+        self.atomic_write(self.path, json.dumps(data))
+        self.generation += 1
+        self.reset_journal()
+
+    def reset_journal(self):
+        try:
+            self.atomic_write(self.journal_path, f"base {self.generation}\n")
+        except OSError:
+            pass
+        self.journal_lines = 0
+
+    @staticmethod
+    def atomic_write(path, text):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+
 class ChessBoardEditor(QDialog):
     def __init__(self):
         super(ChessBoardEditor, self).__init__()
@@ -243,6 +2253,8 @@ class ChessboardMainWindow(QMainWindow):
         self.setFixedSize(418, 720)
         self.central_widget = ChessboardWidget()
         self.setCentralWidget(self.central_widget)
+        self.announce_engine = False
+        settings.engine_resolved.connect(self.engine_resolved)
 
         menubar = self.menuBar()
 
@@ -270,6 +2282,10 @@ class ChessboardMainWindow(QMainWindow):
         load_game_action.triggered.connect(self.central_widget.load_game)
         history_menu.addAction(load_game_action)
 
+        import_pgn_action = QAction('Import PGN', self)
+        import_pgn_action.triggered.connect(self.central_widget.import_pgn)
+        history_menu.addAction(import_pgn_action)
+
         engine_menu = menubar.addMenu('Engine')
 
         search_engine_action = QAction('Search for Stockfish', self)
@@ -289,50 +2305,48 @@ class ChessboardMainWindow(QMainWindow):
         chess_board_editor_action.triggered.connect(self.load_chess_board_editor)
         chess_board_editor_menu.addAction(chess_board_editor_action)
 
+        debug_menu = menubar.addMenu('Debug')
+        metrics_action = QAction('Latency metrics', self)
+        metrics_action.triggered.connect(self.show_metrics_dialog)
+        debug_menu.addAction(metrics_action)
+
     @staticmethod
     def load_chess_board_editor():
         chess_board_editor_dialog = ChessBoardEditor()
         chess_board_editor_dialog.exec_()
 
+    @staticmethod
+    def show_metrics_dialog():
+        MetricsDialog().exec_()
+
     def show_settings_dialog(self):
         settings_dialog = SettingsDialog()
         result = settings_dialog.exec_()
         if result == QDialog.Accepted:
             new_settings = settings_dialog.get_settings()
 
-            json.dump(new_settings, open('settings.json', 'w'))
+            settings.update(new_settings)
             if new_settings["engine(stockfish)"]["path"] == "":
                 self.search_stockfish()
 
-    @staticmethod
-    def search_stockfish():
-        stockfish_path = find_exe_file_in_app_root("stockfish")
+    def search_stockfish(self):
+        self.announce_engine = True
+        settings.resolve_engine_async(force=True)
 
+    def engine_resolved(self, stockfish_path):
+        if not self.announce_engine:
+            return
+        self.announce_engine = False
         if stockfish_path:
             msg = QMessageBox()
             msg.setWindowTitle("Stockfish Found")
             msg.setText(f"Stockfish found at and set:\n{stockfish_path}")
-            try:
-                with open("settings.json", "r") as f:
-                    data = json.load(f)
-                data["engine(stockfish)"]["path"] = str(stockfish_path).replace("\\", "/")
-                json.dump(data, open("settings.json", "w"))
-                f.close()
-            except Exception:
-                with open("settings.json", "w") as f:
-                    data = {"analyse": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128,
-                                        "analyse time": 3000},
-                            "bot": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128,
-                                    "move time": 3000}, "engine(stockfish)": {
-                            "path": "C:/PYTHON/ChessQT/stockfish/stockfish-windows-x86-64-avx2.exe"}}
-                    data["engine(stockfish)"]["path"] = str(stockfish_path).replace("\\", "/")
-                    json.dump(data, f)
-                f.close()
+            settings.set("engine(stockfish)", "path", str(stockfish_path).replace("\\", "/"))
             msg.exec_()
         else:
             msg = QMessageBox()
             msg.setWindowTitle("Stockfish Not Found")
-            msg.setText("Stockfish was not found in the application root or its subfolders.")
+            msg.setText("No UCI engine was found in the application folder, PATH or the configured engine folders.")
             msg.exec()
 
 
@@ -356,17 +2370,97 @@ class ChessPieceDialog(QDialog):
         self.setLayout(layout)
 
 
+class GameClock:
+    def __init__(self, base=300000, increment=0):
+        self.reset(base, increment)
+
+    def reset(self, base, increment):
+        self.base = base
+        self.increment = increment
+        self.remaining = {chess.WHITE: base, chess.BLACK: base}
+        self.running = None
+        self.started = 0.0
+
+    def start(self, color):
+        self.running = color
+        self.started = time.monotonic()
+
+    def stop(self):
+        if self.running is not None:
+            self.remaining[self.running] = self.time_left(self.running)
+            self.running = None
+
+    def press(self, color):
+        self.stop()
+        self.remaining[color] += self.increment
+        self.start(not color)
+
+    def time_left(self, color):
+        if color == self.running:
+            return self.remaining[color] - (time.monotonic() - self.started) * 1000
+        return self.remaining[color]
+
+    def flagged(self):
+        for color in (chess.WHITE, chess.BLACK):
+            if self.time_left(color) <= 0:
+                return color
+        return None
+
+    def go_command(self):
+        times = {color: self.time_left(color) for color in (chess.WHITE, chess.BLACK)}
+        return (f"go wtime {max(1, int(times[chess.WHITE]))} btime {max(1, int(times[chess.BLACK]))} "
+                f"winc {self.increment} binc {self.increment}")
+
+    def budget(self, color):
+        return int(max(1, self.time_left(color)) / 30 + self.increment)
+
+    @staticmethod
+    def format(ms):
+        ms = max(0, int(ms))
+        minutes, ms = divmod(ms, 60000)
+        return f"{minutes}:{ms // 1000:02d}.{ms % 1000 // 100}"
+
+
+class LegalMoveMap:
+    def __init__(self, board):
+        self.destinations = {}
+        self.promotions = set()
+        for move in board.legal_moves:
+            if move.promotion:
+                self.promotions.add((move.from_square, move.to_square))
+                if move.promotion != chess.QUEEN:
+                    continue
+            self.destinations.setdefault(move.from_square, {})[move.to_square] = move
+
+    def targets(self, square):
+        return set(self.destinations.get(square, ()))
+
+    def move(self, from_square, to_square):
+        return self.destinations.get(from_square, {}).get(to_square)
+
+    def is_promotion(self, from_square, to_square):
+        return (from_square, to_square) in self.promotions
+
+    def has_moves(self):
+        return bool(self.destinations)
+
+
 class ChessBoardDialog(QDialog):
-    def __init__(self, move_list):
+    def __init__(self, move_list, start_fen=chess.STARTING_FEN, checkpoint_interval=16, cache_size=64, prefetch=8):
         super().__init__()
 
         self.setWindowTitle("Chessboard")
         self.setFixedSize(420, 500)
 
         layout = QVBoxLayout(self)
-        self.svgWidget = QSvgWidget(self)
-        self.svgWidget.setFixedSize(400, 400)
-        layout.addWidget(self.svgWidget)
+        self.board_label = QLabel(self)
+        self.board_label.setFixedSize(400, 400)
+        layout.addWidget(self.board_label)
+
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setRange(0, len(move_list))
+        self.slider.valueChanged.connect(self.seek)
+        layout.addWidget(self.slider)
 
         control_layout = QHBoxLayout()
         self.control_button = QPushButton("Resume")
@@ -383,22 +2477,69 @@ class ChessBoardDialog(QDialog):
 
         layout.addLayout(control_layout)
 
-        self.board = chess.Board()
-        try:
-            data = json.load(open("set.json", "r"))
-        except Exception:
-            data = {"last fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "move history": [],
-                    "start fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"}
-            json.dump(data, open("set.json", "w"))
-        self.board.set_fen(data["start fen"])
-        self.moves = move_list
+        self.moves = list(move_list)
+        self.renderer = BoardRenderer(400)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = []
+        board = chess.Board(start_fen)
+        for ply in range(len(self.moves) + 1):
+            if ply % checkpoint_interval == 0:
+                self.checkpoints.append(board.copy(stack=False))
+            if ply < len(self.moves):
+                board.push(self.moves[ply])
+        self.frames = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.prefetch = prefetch
 
         self.move_index = 0
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.play_next_move)
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setInterval(0)
+        self.prefetch_timer.timeout.connect(self.prefetch_next_frame)
         self.playback_paused = True
-        svg = chess.svg.board(board=self.board, size=250)
-        self.svgWidget.load(svg.encode('utf-8'))
+        self.seek(0)
+
+    def board_at(self, ply):
+        board = self.checkpoints[ply // self.checkpoint_interval].copy(stack=False)
+        for move in self.moves[ply - ply % self.checkpoint_interval:ply]:
+            board.push(move)
+        return board
+
+    def frame(self, ply):
+        pixmap = self.frames.get(ply)
+        if pixmap is not None:
+            self.frames.move_to_end(ply)
+            return pixmap
+        board = self.board_at(ply)
+        pixmap = self.renderer.render(board, check=board.king(board.turn) if board.is_check() else None,
+                                      lastmove=self.moves[ply - 1] if ply else None)
+        self.frames[ply] = pixmap
+        if len(self.frames) > self.cache_size:
+            self.frames.popitem(last=False)
+        return pixmap
+
+    def prefetch_next_frame(self):
+        for ply in range(self.move_index + 1, min(self.move_index + self.prefetch, len(self.moves)) + 1):
+            if ply not in self.frames:
+                self.frame(ply)
+                return
+        self.prefetch_timer.stop()
+
+    def seek(self, ply):
+        ply = max(0, min(ply, len(self.moves)))
+        self.move_index = ply
+        self.board_label.setPixmap(self.frame(ply))
+        self.slider.blockSignals(True)
+        self.slider.setValue(ply)
+        self.slider.blockSignals(False)
+        at_end = ply >= len(self.moves)
+        if at_end and not self.playback_paused:
+            self.toggle_playback()
+        self.control_button.setDisabled(at_end)
+        self.next_button.setDisabled(at_end)
+        self.prev_button.setDisabled(ply == 0)
+        self.prefetch_timer.start()
 
     def toggle_playback(self):
         if self.playback_paused:
@@ -411,64 +2552,374 @@ class ChessBoardDialog(QDialog):
             self.timer.stop()
 
     def play_next_move(self):
-        if self.move_index < len(self.moves):
-            move = self.moves[self.move_index]
-            self.board.push(move)
-            check_square = self.board.king(self.board.turn) if self.board.is_check() else None
-            svg = chess.svg.board(board=self.board, size=250, lastmove=move, check=check_square)
-            self.svgWidget.load(svg.encode('utf-8'))
-            self.move_index += 1
-        else:
-            self.timer.stop()
-            self.control_button.setDisabled(True)
-            self.next_button.setDisabled(True)
+        self.seek(self.move_index + 1)
 
     def play_previous_move(self):
-        if self.move_index > 0:
-            self.move_index -= 1
-            self.board.pop()
-            svg = chess.svg.board(board=self.board, size=250)
-            self.svgWidget.load(svg.encode('utf-8'))
-            self.control_button.setText("Stop")
-            self.control_button.setDisabled(False)
-            self.next_button.setDisabled(False)
+        self.seek(self.move_index - 1)
+
+
+class GameTableModel(QAbstractTableModel):
+    columns = ["#", "White", "Black", "Result", "Date", "ECO", "Event", "Plies"]
+
+    def __init__(self, store, player="", page_size=200):
+        super(GameTableModel, self).__init__()
+        self.store = store
+        self.player = player
+        self.page_size = page_size
+        self.rows = []
+        self.exhausted = False
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            value = self.rows[index.row()][index.column()]
+            return "" if value is None else str(value)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
+        return None
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent):
+        rows = self.store.page(self.rows[-1][0] if self.rows else 0, self.page_size, self.player)
+        self.exhausted = len(rows) < self.page_size
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def game_id(self, row):
+        return self.rows[row][0]
+
+
+class PgnImportThread(QThread):
+    progress = pyqtSignal(int, int, int)
+
+    def __init__(self, store, pgn_path):
+        super(PgnImportThread, self).__init__()
+        self.store = store
+        self.pgn_path = pgn_path
+        self.cancel_requested = False
+        self.imported = 0
+        self.error = None
+
+    def cancel(self):
+        self.cancel_requested = True
+
+    def report(self, done, total, imported):
+        self.imported = imported
+        self.progress.emit(done * 1000 // max(total, 1), 1000, imported)
+
+    def run(self):
+        try:
+            import_pgn(self.store, self.pgn_path, progress=self.report, cancelled=lambda: self.cancel_requested)
+        except Exception as e:
+            self.error = str(e)
+
+
+class GameBrowserDialog(QDialog):
+    def __init__(self, store):
+        super(GameBrowserDialog, self).__init__()
+        self.setWindowTitle(os.path.basename(store.path))
+        self.setGeometry(150, 150, 700, 500)
+        self.store = store
+        self.selected_game_id = None
+
+        layout = QVBoxLayout(self)
+        search_layout = QHBoxLayout()
+        self.player_edit = QLineEdit()
+        self.player_edit.setPlaceholderText('player')
+        self.player_edit.returnPressed.connect(self.search)
+        search_layout.addWidget(self.player_edit)
+        search_button = QPushButton('Search')
+        search_button.clicked.connect(self.search)
+        search_layout.addWidget(search_button)
+        layout.addLayout(search_layout)
+
+        self.table = QTableView()
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.doubleClicked.connect(self.accept)
+        self.table.setModel(GameTableModel(store))
+        layout.addWidget(self.table)
+
+        open_button = QPushButton('Open')
+        open_button.clicked.connect(self.accept)
+        layout.addWidget(open_button)
+
+    def search(self):
+        self.table.setModel(GameTableModel(self.store, self.player_edit.text().strip()))
+
+    def accept(self):
+        index = self.table.currentIndex()
+        if index.isValid():
+            self.selected_game_id = self.table.model().game_id(index.row())
+            super(GameBrowserDialog, self).accept()
+
+
+class MetricsDialog(QDialog):
+    columns = ["span", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms", "max ms"]
+
+    def __init__(self):
+        super(MetricsDialog, self).__init__()
+        self.setWindowTitle('Latency metrics')
+        self.setGeometry(150, 150, 640, 420)
+
+        layout = QVBoxLayout(self)
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        for text, slot in (('Refresh', self.refresh), ('Reset', self.reset), ('Export', self.export)):
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            button_layout.addWidget(button)
+        layout.addLayout(button_layout)
+        self.refresh()
+
+    def refresh(self):
+        self.status_label.setText('recording' if tracer.enabled else
+                                  'recording is off, enable it in Settings')
+        summary = tracer.summary()
+        self.table.setRowCount(len(summary))
+        for row, (name, histogram) in enumerate(summary.items()):
+            values = [name, str(histogram["count"])] + [f"{histogram[key]:.2f}" for key in
+                                                        ("mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        self.table.resizeColumnsToContents()
+
+    def reset(self):
+        tracer.reset()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export metrics", tracer.export_path or "metrics.prom",
+                                              "Prometheus (*.prom);;JSON (*.json)")
+        if path:
+            tracer.dump(path)
+
+
+class GameAnalysis(QObject):
+    updated = pyqtSignal()
+    marks = ((300, "??"), (100, "?"))
+
+    def __init__(self, board):
+        super(GameAnalysis, self).__init__()
+        self.board = board
+        self.scores = {}
+        self.keys = []
+        self.request = None
+        self.request_position = None
+        self.paused = False
+        self.hub = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.schedule)
+
+    def enabled(self):
+        return settings.get("game analysis", "enabled")
+
+    def update(self):
+        if self.enabled():
+            self.timer.start(0)
+
+    def pause(self):
+        self.paused = True
+        self.cancel()
+
+    def resume(self):
+        self.paused = False
+        self.update()
+
+    def cancel(self):
+        request_id, self.request = self.request, None
+        if request_id is not None:
+            self.hub.cancel(request_id)
+
+    def reset(self):
+        self.cancel()
+        self.scores.clear()
+        self.update()
+
+    @staticmethod
+    def score(result, board):
+        score = result.get("score")
+        if score is None:
+            return None
+        score_type, value = score
+        if score_type == "mate":
+            value = 10000 - abs(value) if value > 0 else -10000 + abs(value)
+        return value if board.turn == chess.WHITE else -value
+
+    @staticmethod
+    def final_score(board):
+        if board.is_checkmate():
+            return -10000 if board.turn == chess.WHITE else 10000
+        return 0
+
+    def schedule(self):
+        self.keys = []
+        board = self.board.root()
+        pending = None
+        for ply in range(len(self.board.move_stack) + 1):
+            if ply:
+                board.push(self.board.move_stack[ply - 1])
+            key = zobrist_key(board)
+            self.keys.append((key, board.turn))
+            if pending is None and key not in self.scores:
+                if board.is_game_over():
+                    self.scores[key] = self.final_score(board)
+                else:
+                    pending = board.copy()
+        self.updated.emit()
+        if pending is None or self.paused or self.request is not None or not self.enabled():
+            return
+        data = settings.snapshot()
+        engine_path = settings.engine_path()
+        options = settings.engine_options("analyse")
+        options["Threads"] = data["game analysis"]["threads"]
+        depth = data["game analysis"]["depth"]
+        identity = engine_identity(engine_path, options)
+        result = get_eval_cache().get(pending, identity, depth=depth)
+        if result is not None and self.score(result, pending) is not None:
+            self.scores[zobrist_key(pending)] = self.score(result, pending)
+            self.timer.start(0)
+            return
+        if self.hub is None:
+            self.hub = get_engine_hub()
+            self.hub.result_ready.connect(self.result_ready)
+            self.hub.request_failed.connect(self.request_failed)
+        self.request_position = (zobrist_key(pending), pending, identity)
+        self.request = self.hub.submit("background", engine_path, position_command(pending), f"go depth {depth}",
+                                       options, daemon=data["engine(stockfish)"]["daemon socket"], nice=19,
+                                       session="background")
+
+    def result_ready(self, request_id, result):
+        if request_id != self.request:
+            return
+        self.request = None
+        key, board, identity = self.request_position
+        score = self.score(result, board)
+        if score is not None:
+            self.scores[key] = score
+            get_eval_cache().put(board, identity, result)
+            self.update()
+
+    def request_failed(self, request_id, reason):
+        if request_id == self.request:
+            self.request = None
+
+    def evaluations(self):
+        return [self.scores.get(key) for key, _ in self.keys]
+
+    def move_marks(self):
+        evaluations = self.evaluations()
+        marks = []
+        for ply in range(len(evaluations) - 1):
+            before, after = evaluations[ply], evaluations[ply + 1]
+            mark = ""
+            if before is not None and after is not None:
+                before, after = max(-1000, min(1000, before)), max(-1000, min(1000, after))
+                loss = before - after if self.keys[ply][1] == chess.WHITE else after - before
+                mark = next((text for threshold, text in self.marks if loss >= threshold), "")
+            marks.append(mark)
+        return marks
+
+
+class EvalGraph(QWidget):
+    def __init__(self, analysis, parent=None):
+        super(EvalGraph, self).__init__(parent)
+        self.analysis = analysis
+        self.setFixedHeight(60)
+        analysis.updated.connect(self.update)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#404040"))
+        evaluations = self.analysis.evaluations()
+        width, height = self.width(), self.height()
+        if len(evaluations) > 1:
+            step = width / (len(evaluations) - 1)
+            points = [QPointF(0, height)]
+            for ply, score in enumerate(evaluations):
+                score = 0 if score is None else max(-1000, min(1000, score))
+                points.append(QPointF(ply * step, height / 2 - score * height / 2000))
+            points.append(QPointF(width, height))
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QColor("#f0f0f0"))
+            painter.drawPolygon(QPolygonF(points))
+        painter.setPen(QPen(QColor("#808080"), 1))
+        painter.drawLine(0, height // 2, width, height // 2)
+        painter.end()
 
 
 class ChessboardWidget(QWidget):
     def __init__(self):
         super(ChessboardWidget, self).__init__()
         self.bot_playing = False
-        self.bot_thread = None
-        self.engine_path = "C:/PYTHON/ChessQT/stockfish/stockfish-windows-x86-64-avx2.exe"
+        self.bot_search = None
+        self.analysis_request = None
+        self.analysis_cache = None
+        self.hub_connected = False
+        self.engine_path = settings.engine_path()
+        settings.engine_resolved.connect(self.update_engine_path)
         self.bot_side = chess.WHITE
         self.board = chess.Board()
         self.selected_square = None
         self.possible_moves = set()
+        self.move_map = None
         self.last_move = None
         self.move_history = []
         self.arrows = []
         self.current_game_id = None
+        self.current_game_path = None
+        self.game_store = None
+        self.game_analysis = GameAnalysis(self.board)
         self.init_ui()
         self.last_analyse_move = None
         self.busy = False
-        self.start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+        self.start_fen = chess.STARTING_FEN
+        self.session = SessionStore()
 
+        start_fen, moves = self.session.load()
         try:
-            data = json.load(open("set.json", "r"))
-            self.board.set_fen(data["start fen"])
-            self.move_history = [chess.Move.from_uci(i) for i in data["move history"]]
+            self.board.set_fen(start_fen)
+            self.start_fen = start_fen
+            self.move_history = [chess.Move.from_uci(i) for i in moves]
             for i in self.move_history:
                 self.board.push(i)
-            for i in data["move history"]:
-                item = i
-                self.move_list.addItem(item)
-
+            for i in moves:
+                self.move_list.addItem(i)
         except Exception:
-            data = {"last fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "move history": [],
-                    "start fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"}
-            self.board.set_fen(data["last fen"])
-            self.move_history = [chess.Move.from_uci(i) for i in data["move history"]]
+            self.board.reset()
+            self.start_fen = chess.STARTING_FEN
+            self.move_history = []
+            self.move_list.clear()
         self.update_svg()
+        self.game_analysis.update()
+
+    def game_record(self):
+        outcome = self.board.outcome()
+        headers = {"Event": "ChessQt game", "Date": datetime.date.today().strftime("%Y.%m.%d"),
+                   "White": "Player", "Black": "Player", "Result": outcome.result() if outcome else "*"}
+        if self.bot_playing:
+            headers["White" if self.bot_side == chess.WHITE else "Black"] = "Stockfish"
+        return {"headers": headers, "start_fen": self.board.root().fen(), "moves": list(self.board.move_stack)}
 
     def save_game(self):
         options = QFileDialog.Options()
@@ -478,25 +2929,12 @@ class ChessboardWidget(QWidget):
                                                    options=options)
         if file_name:
             try:
-                conn = sqlite3.connect(file_name)
-                cursor = conn.cursor()
-
-                cursor.execute("CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, fen TEXT, moves TEXT)")
-
-                fen = self.board.fen()
-                moves = " ".join([str(move) for move in self.move_history])
-
-                cursor.execute("SELECT id FROM games ORDER BY id DESC LIMIT 1")
-                row = cursor.fetchone()
-
-                if row:
-                    latest_id = row[0]
-                    cursor.execute("UPDATE games SET fen = ?, moves = ? WHERE id = ?", (fen, moves, latest_id))
+                store = self.game_store = get_game_store(file_name)
+                if self.current_game_id is not None and self.current_game_path == store.path:
+                    store.update_game(self.current_game_id, self.game_record())
                 else:
-                    cursor.execute("INSERT INTO games (fen, moves) VALUES (?, ?)", (fen, moves))
-
-                conn.commit()
-                conn.close()
+                    self.current_game_id = store.add_game(self.game_record())
+                    self.current_game_path = store.path
             except Exception:
                 pass
 
@@ -508,23 +2946,101 @@ class ChessboardWidget(QWidget):
                                                    options=options)
         if file_name:
             try:
-                conn = sqlite3.connect(file_name)
-                cursor = conn.cursor()
-
-                cursor.execute("SELECT fen, moves FROM games ORDER BY id DESC LIMIT 1")
-                row = cursor.fetchone()
-
-                if row:
-                    fen, moves_str = row
-                    self.board.set_fen(fen)
-                    moves = moves_str.split()
-                    self.load_game_moves([chess.Move.from_uci(move) for move in moves])
-                    self.update_svg()
-
-                conn.close()
+                store = self.game_store = get_game_store(file_name)
+                dialog = GameBrowserDialog(store)
+                if dialog.exec_() == QDialog.Accepted:
+                    self.open_game(store, dialog.selected_game_id)
             except Exception:
                 self.update_svg()
 
+    def import_pgn(self):
+        pgn_name, _ = QFileDialog.getOpenFileName(self, "Import PGN", "", "PGN Files (*.pgn);;All Files (*)")
+        if not pgn_name:
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Import into database", "",
+                                                   "SQLite Database (*.db);;All Files (*)",
+                                                   options=QFileDialog.DontConfirmOverwrite)
+        if not file_name:
+            return
+        self.game_store = get_game_store(file_name)
+        self.import_thread = PgnImportThread(self.game_store, pgn_name)
+        progress_dialog = QProgressDialog("Importing games...", "Cancel", 0, 1000, self)
+        progress_dialog.setWindowTitle("Import PGN")
+        progress_dialog.setMinimumDuration(0)
+        progress_dialog.canceled.connect(self.import_thread.cancel)
+        self.import_thread.progress.connect(
+            lambda done, total, imported: (progress_dialog.setValue(done),
+                                           progress_dialog.setLabelText(f"Imported {imported} games")))
+        self.import_thread.finished.connect(progress_dialog.reset)
+        self.import_thread.finished.connect(self.import_finished)
+        self.import_thread.start()
+
+    def import_finished(self):
+        msg = QMessageBox()
+        msg.setWindowTitle("Import PGN")
+        if self.import_thread.error:
+            msg.setText(f"Import failed:\n{self.import_thread.error}")
+        else:
+            msg.setText(f"Imported {self.import_thread.imported} games.")
+        msg.exec_()
+
+    def current_game_store(self):
+        if self.game_store is None:
+            file_name, _ = QFileDialog.getOpenFileName(self, "Choose game database", "",
+                                                       "SQLite Database (*.db);;All Files (*)")
+            if file_name:
+                self.game_store = get_game_store(file_name)
+        return self.game_store
+
+    def find_games(self):
+        store = self.current_game_store()
+        self.found_games_list.clear()
+        if store is None:
+            return
+        for game_id, ply, white, black, result, date in store.find_position(self.board):
+            item = QListWidgetItem(f"#{game_id} {white or '?'} - {black or '?'} {result or '*'} {date or ''}, "
+                                   f"ply {ply}")
+            item.setData(Qt.UserRole, (game_id, ply))
+            self.found_games_list.addItem(item)
+        progress = store.index_progress("positions")
+        if progress is not None:
+            self.found_games_list.addItem(f"(indexing the database, {progress:.0%} done - results are incomplete)")
+
+    def update_explorer(self):
+        if self.tab_widget.currentWidget() is not self.explorer_tab or self.game_store is None:
+            return
+        progress = self.game_store.index_progress("positions")
+        key = (self.game_store.path, zobrist_key(self.board), progress)
+        if key == self.explorer_key and progress is None:
+            return
+        self.explorer_key = key
+        self.explorer_status.setText(f"Indexing the database, {progress:.0%} done - counts are incomplete"
+                                     if progress is not None else "")
+        self.explorer_status.setVisible(progress is not None)
+        rows = self.game_store.explore(self.board)
+        self.explorer_table.setRowCount(len(rows))
+        for row, (move, games, white_wins, draws, black_wins) in enumerate(rows):
+            decided = white_wins + draws + black_wins
+            average = f"{(white_wins + draws / 2) * 100 / decided:.1f}%" if decided else ""
+            percentages = (f"{white_wins * 100 // decided}% / {draws * 100 // decided}% / "
+                           f"{black_wins * 100 // decided}%") if decided else ""
+            san = self.board.san(move) if self.board.is_legal(move) else move.uci()
+            for column, text in enumerate([san, str(games), percentages, average]):
+                self.explorer_table.setItem(row, column, QTableWidgetItem(text))
+
+    def open_found_game(self, item):
+        if item.data(Qt.UserRole) is None:
+            return
+        game_id, ply = item.data(Qt.UserRole)
+        self.open_game(self.game_store, game_id, ply)
+
+    def open_game(self, store, game_id, ply=None):
+        game = store.get_game(game_id)
+        if game is not None:
+            self.load_game_moves(game["moves"][:ply], start_fen=game["start_fen"])
+            self.current_game_id = game_id
+            self.current_game_path = store.path
+
     def save_fen(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
@@ -538,28 +3054,32 @@ class ChessboardWidget(QWidget):
                 pass
 
     def update_last_move(self):
-        try:
-            with open("set.json", "r") as f:
-                data = json.load(f)
-            data["last fen"] = str(self.board.fen())
-            data["move history"] = [i.uci() for i in self.move_history]
-            json.dump(data, open("set.json", "w"))
-            f.close()
-        except Exception:
-            data = {"last fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "move history": [],
-                    "start fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"}
-            with open("set.json", "w") as f:
-                json.dump(data, f)
-            f.close()
+        self.session.record(self.board)
+        self.game_analysis.update()
 
     def init_ui(self):
         self.setGeometry(10, 10, 600, 600)
         layout = QVBoxLayout(self)
         board_size = 400
 
-        self.svg_widget = QSvgWidget(self)
-        self.svg_widget.setFixedSize(board_size, board_size)
-        layout.addWidget(self.svg_widget)
+        self.board_view = BoardView(self, board_size)
+        layout.addWidget(self.board_view)
+
+        self.clock_label = QLabel(self)
+        self.clock_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.clock_label)
+        self.clock = GameClock()
+        self.clock_enabled = False
+        self.clock_timer = QTimer(self)
+        self.clock_timer.setInterval(100)
+        self.clock_timer.timeout.connect(self.update_clock)
+        self.reset_clock()
+        settings.changed.connect(self.settings_changed)
+
+        self.eval_graph = EvalGraph(self.game_analysis, self)
+        self.eval_graph.setVisible(self.game_analysis.enabled())
+        layout.addWidget(self.eval_graph)
+        self.game_analysis.updated.connect(self.mark_moves)
 
         self.move_list = QListWidget(self)
         layout.addWidget(self.move_list)
@@ -599,34 +3119,130 @@ class ChessboardWidget(QWidget):
         analysis_tab.setLayout(analysis_tab.layout)
         self.tab_widget.addTab(analysis_tab, "Analysis")
 
+        self.explorer_tab = QWidget()
+        self.explorer_tab.layout = QVBoxLayout()
+        self.explorer_key = None
+
+        self.explorer_status = QLabel(self)
+        self.explorer_status.setVisible(False)
+        self.explorer_tab.layout.addWidget(self.explorer_status)
+
+        self.explorer_table = QTableWidget(0, 4, self)
+        self.explorer_table.setHorizontalHeaderLabels(["Move", "Games", "White / Draw / Black", "Avg"])
+        self.explorer_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.explorer_table.verticalHeader().setVisible(False)
+        self.explorer_tab.layout.addWidget(self.explorer_table)
+
+        self.explorer_tab.setLayout(self.explorer_tab.layout)
+        self.tab_widget.addTab(self.explorer_tab, "Explorer")
+        self.tab_widget.currentChanged.connect(lambda _: self.update_explorer())
+
+        games_tab = QWidget()
+        games_tab.layout = QVBoxLayout()
+
+        self.find_games_button = QPushButton('Find games with this position', self)
+        self.find_games_button.clicked.connect(self.find_games)
+        games_tab.layout.addWidget(self.find_games_button)
+
+        self.found_games_list = QListWidget(self)
+        self.found_games_list.itemDoubleClicked.connect(self.open_found_game)
+        games_tab.layout.addWidget(self.found_games_list)
+
+        games_tab.setLayout(games_tab.layout)
+        self.tab_widget.addTab(games_tab, "Games")
+
         self.setMouseTracking(True)
 
     def toggle_bot(self):
         self.bot_playing = not self.bot_playing
         self.bot_side = self.bot_side_combobox.currentData()
         if self.bot_playing:
-            self.bot_thread = BotThread(self.board.copy(), self.bot_side)
-            self.bot_thread.move_ready.connect(self.bot_move_ready)
-            self.bot_thread.start()
+            self.start_bot()
             self.start_button.setDisabled(True)
         else:
-            if self.bot_thread:
-                self.bot_thread.terminate()
+            self.cancel_bot()
+            stop_engine_ponder()
             self.start_button.setDisabled(False)
         self.update_svg()
 
-    def bot_move_ready(self, move):
+    def start_bot(self):
+        if self.time_over():
+            return
+        if self.board.turn == self.bot_side:
+            self.game_analysis.pause()
+        self.bot_search = BotSearch(self.board.copy(), self.bot_side, self.engine_path, self.active_clock())
+        self.bot_search.move_ready.connect(self.bot_move_ready)
+        self.bot_search.search_failed.connect(self.bot_failed)
+        self.bot_search.start()
+
+    def cancel_bot(self):
+        if self.bot_search is not None:
+            self.bot_search.cancel()
+            self.bot_search = None
+            self.busy = False
+            self.start_button.setDisabled(False)
+        self.game_analysis.resume()
+
+    def cancel_analysis(self):
+        request_id, self.analysis_request = self.analysis_request, None
+        if request_id is None:
+            return False
+        get_engine_hub().cancel(request_id)
+        self.busy = False
+        return True
+
+    def supersede_analysis(self):
+        bot_to_move = self.bot_playing and self.board.turn == self.bot_side_combobox.currentData()
+        if self.cancel_analysis() and not bot_to_move:
+            self.analyze()
+
+    def bot_move_ready(self, move, request_id):
+        if self.bot_search is None or self.bot_search.request.id != request_id:
+            return
         self.check_for_checkmate()
         self.update_svg()
         self.clear_arrows()
-        self.board.push(move)
-        self.add_move_to_list(move.uci())
-        self.last_move = move
-        self.move_history.append(move)
+        self.push_move(move)
+        self.press_clock()
         self.update_svg()
-        self.bot_thread = None
+        self.bot_search = None
         self.start_button.setDisabled(False)
         self.busy = False
+        self.game_analysis.resume()
+
+    def bot_failed(self, request_id, reason):
+        if self.bot_search is None or self.bot_search.request.id != request_id:
+            return
+        self.analysis_textedit.append(f"bot search failed: {reason}")
+        self.bot_playing = False
+        self.cancel_bot()
+
+    def engine_hub(self):
+        hub = get_engine_hub()
+        if not self.hub_connected:
+            hub.info_ready.connect(self.analysis_info)
+            hub.result_ready.connect(self.analysis_result)
+            hub.request_failed.connect(self.analysis_failed)
+            self.hub_connected = True
+        return hub
+
+    def analysis_info(self, request_id, info):
+        if request_id == self.analysis_request:
+            self.update_analyse(chess.Move.from_uci(info["pv"][0]))
+
+    def analysis_result(self, request_id, result):
+        if request_id != self.analysis_request:
+            return
+        self.analysis_request = None
+        self.busy = False
+        board, identity, movetime = self.analysis_cache
+        get_eval_cache().put(board, identity, result, movetime)
+
+    def analysis_failed(self, request_id, reason):
+        if request_id == self.analysis_request:
+            self.analysis_request = None
+            self.busy = False
+            self.analysis_textedit.append(f"analysis failed: {reason}")
 
     def update_analyse(self, move):
         for i in range(3):
@@ -642,10 +3258,15 @@ class ChessboardWidget(QWidget):
         self.arrows = []
 
     def update_svg(self):
+        with tracer.span("render"):
+            self.refresh_board()
+
+    def refresh_board(self):
         self.check_for_checkmate()
-        board_svg = self.create_custom_svg()
-        self.svg_widget.load(board_svg.encode())
+        self.board_view.set_position(self.board, fill=self.get_fill_dict(), arrows=self.arrows,
+                                     check=self.board.king(self.board.turn) if self.board.is_check() else None)
         self.update_last_move()
+        self.update_explorer()
 
     def create_custom_svg(self):
         custom_svg = svg.board(
@@ -676,17 +3297,14 @@ class ChessboardWidget(QWidget):
         return square_set
 
     def mousePressEvent(self, event):
-        if not self.busy:
-            if event.button() == Qt.LeftButton:
-                if 24 <= event.x() <= 392 and 24 <= event.y() <= 392:
-                    corrected_x = event.x() - 24
-                    corrected_y = event.y() - 24
-                    col = corrected_x * 8 // (392 - 24) if corrected_x * 8 // (392 - 24) <= 7 else 7
-                    row = 7 - corrected_y * 8 // (392 - 24) if 7 - corrected_y * 8 // (392 - 24) <= 7 else 7
-
-                    square = chess.square(col, row)
-                    self.update_svg()
+        with tracer.span("click"):
+            self.handle_click(event)
 
+    def handle_click(self, event):
+        if not self.busy and not self.time_over():
+            if event.button() == Qt.LeftButton:
+                square = self.board_view.square_at(self.board_view.mapFrom(self, event.pos()))
+                if square is not None:
                     if self.selected_square is None:
                         piece = self.board.piece_at(square)
 
@@ -698,45 +3316,27 @@ class ChessboardWidget(QWidget):
                             self.possible_moves.clear()
                         self.update_svg()
                     else:
-                        move = chess.Move(self.selected_square, square)
-
-                        prom_move = chess.Move(self.selected_square, square, promotion=chess.QUEEN)
-                        if prom_move in self.board.legal_moves:
+                        move_map = self.legal_move_map()
+                        move = move_map.move(self.selected_square, square)
+                        if move is not None and move_map.is_promotion(self.selected_square, square):
                             dialog = ChessPieceDialog()
-                            result = dialog.exec_()
-                            if result == QDialog.Accepted:
-                                selected_piece = dialog.combo_box.currentText()
-                                if selected_piece == "queen":
-                                    selected_piece = chess.QUEEN
-                                if selected_piece == "knight":
-                                    selected_piece = chess.KNIGHT
-                                if selected_piece == "rook":
-                                    selected_piece = chess.ROOK
-                                if selected_piece == "bishop":
-                                    selected_piece = chess.BISHOP
-                                prom_move = chess.Move(self.selected_square, square, promotion=selected_piece)
-                                self.board.push(prom_move)
-                        elif move in self.board.legal_moves:
-                            if (self.board.turn == chess.WHITE and self.board.piece_at(
-                                    move.from_square) == chess.PAWN and
-                                    move.from_uci()[1] == '7' or
-                                    self.board.turn == chess.BLACK and self.board.piece_at(
-                                        move.from_square) == chess.PAWN and
-                                    move.from_uci()[1] == '2'):
-                                self.board.push(chess.Move(self.selected_square, square, promotion=chess.QUEEN))
+                            if dialog.exec_() == QDialog.Accepted:
+                                promotion = {"queen": chess.QUEEN, "knight": chess.KNIGHT, "rook": chess.ROOK,
+                                             "bishop": chess.BISHOP}.get(dialog.combo_box.currentText(), chess.QUEEN)
+                                move = chess.Move(self.selected_square, square, promotion=promotion)
                             else:
-                                self.board.push(move)
+                                move = None
+                        if move is not None:
                             self.clear_arrows()
-                            self.update_svg()
-                            self.add_move_to_list(move.uci())
+                            self.push_move(move)
+                            self.press_clock()
                             print(move)
-                            self.last_move = move
-                            self.move_history.append(move)
                             if self.bot_playing:
+                                engine_ponderhit(position_command(self.board))
+                            self.supersede_analysis()
+                            if self.bot_playing and self.legal_move_map().has_moves():
                                 self.bot_side = self.bot_side_combobox.currentData()
-                                self.bot_thread = BotThread(self.board.copy(), self.bot_side)
-                                self.bot_thread.move_ready.connect(self.bot_move_ready)
-                                self.bot_thread.start()
+                                self.start_bot()
                                 self.busy = True
                             self.analysis_textedit.clear()
                         self.selected_square = None
@@ -747,12 +3347,17 @@ class ChessboardWidget(QWidget):
         try:
             if self.move_history:
                 self.board.pop()
+                self.move_map = None
+                self.move_history.pop()
+                self.cancel_bot()
+                stop_engine_ponder()
                 self.clear_arrows()
 
                 self.last_move = None
                 self.update_svg()
                 self.clear_move_list()
                 self.update_last_move()
+                self.supersede_analysis()
         except Exception:
             pass
 
@@ -762,9 +3367,22 @@ class ChessboardWidget(QWidget):
             self.add_move_to_list(move.uci())
         self.update_last_move()
 
+    def legal_move_map(self):
+        if self.move_map is None:
+            with tracer.span("legal_moves"):
+                self.move_map = LegalMoveMap(self.board)
+        return self.move_map
+
+    def push_move(self, move):
+        with tracer.span("push"):
+            self.board.push(move)
+        self.move_map = None
+        self.add_move_to_list(move.uci())
+        self.last_move = move
+        self.move_history.append(move)
+
     def get_possible_moves(self, square):
-        legal_moves = self.board.legal_moves
-        return set(move.to_square for move in legal_moves if move.from_square == square)
+        return self.legal_move_map().targets(square)
 
     def add_move_to_list(self, move):
         move_text = move
@@ -792,22 +3410,44 @@ class ChessboardWidget(QWidget):
 
     def new_game(self):
         self.board.reset()
+        self.move_map = None
         self.selected_square = None
         self.possible_moves.clear()
         self.last_move = None
         self.move_history = []
         self.clear_arrows()
+        self.start_fen = self.board.fen()
         self.update_svg()
         self.clear_move_list()
         self.current_game_id = None
+        self.cancel_bot()
+        self.cancel_analysis()
+        engine_new_game()
+        self.reset_clock()
 
     def analyze(self):
-        currnt_board = self.board
+        board = self.board.copy()
         self.clear_arrows()
+        self.cancel_analysis()
+        data = settings.snapshot()
         try:
-            self.analyze_thread = AnalyzeThread(currnt_board)
-            self.analyze_thread.analyze_ready.connect(self.update_analyse)
-            self.analyze_thread.start()
+            with tracer.span("tablebase"):
+                move = tablebase_move(board, data["syzygy"]["path"])
+            if move is not None:
+                self.update_analyse(move)
+                return
+            engine_path = self.engine_path
+            options = settings.engine_options("analyse")
+            movetime = data['analyse']['analyse time']
+            identity = engine_identity(engine_path, options)
+            result = get_eval_cache().get(board, identity, movetime=movetime)
+            if result is not None:
+                self.update_analyse(chess.Move.from_uci(result["pv"][0]))
+                return
+            self.analysis_cache = (board, identity, movetime)
+            self.analysis_request = self.engine_hub().submit(
+                "analyse", engine_path, position_command(board), f"go movetime {movetime}", options,
+                timeout=movetime / 1000 + 5, supersede=True, daemon=data["engine(stockfish)"]["daemon socket"])
             self.busy = True
         except Exception:
             pass
@@ -820,33 +3460,90 @@ class ChessboardWidget(QWidget):
             msg.setWindowTitle("Game Over")
             msg.setText(f"Checkmate! {winner} wins!")
             msg.exec_()
-            dialog = ChessBoardDialog(self.move_history)
+            dialog = ChessBoardDialog(self.move_history, self.start_fen)
             dialog.exec_()
 
-    def load_game_moves(self, moves):
-        self.board.reset()
-
+    def load_game_moves(self, moves, start_fen=None):
         self.selected_square = None
         self.possible_moves.clear()
         self.last_move = None
         self.move_history = []
+        self.move_list.clear()
         self.clear_arrows()
-        try:
-            data = json.load(open("set.json", "r"))
-            self.board.set_fen(data["start fen"])
-        except Exception:
-            data = {"last fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", "move history": [],
-                    "start fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"}
-            json.dump(data, open("set.json", "w"))
-            self.board.set_fen(data["start fen"])
+        self.board.set_fen(start_fen or self.start_fen)
+        self.move_map = None
+        self.start_fen = self.board.fen()
+        self.cancel_bot()
+        self.cancel_analysis()
+        engine_new_game()
+        self.reset_clock()
         for move in moves:
-            self.board.push(move)
-            self.add_move_to_list(move.uci())
-            self.last_move = move
-            self.move_history.append(move)
+            self.push_move(move)
 
         self.update_svg()
 
+    def reset_clock(self):
+        clock_settings = settings.section("clock")
+        self.clock.reset(clock_settings["base(s)"] * 1000, clock_settings["increment(s)"] * 1000)
+        self.clock_timer.stop()
+        self.clock_enabled = clock_settings["enabled"]
+        self.clock_label.setVisible(self.clock_enabled)
+        self.update_clock()
+
+    def settings_changed(self, changes):
+        if "clock" in changes and self.clock.running is None:
+            self.reset_clock()
+        if "engine(stockfish)" in changes:
+            self.update_engine_path()
+        if {"game analysis", "analyse", "engine(stockfish)"} & set(changes):
+            self.eval_graph.setVisible(self.game_analysis.enabled())
+            self.game_analysis.reset()
+            if not self.game_analysis.enabled():
+                self.mark_moves()
+
+    def update_engine_path(self, path=None):
+        self.engine_path = settings.engine_path()
+
+    def mark_moves(self):
+        marks = self.game_analysis.move_marks() if self.game_analysis.enabled() else []
+        for ply, move in enumerate(self.board.move_stack[:self.move_list.count()]):
+            text = move.uci() + (marks[ply] if ply < len(marks) else "")
+            item = self.move_list.item(ply)
+            if item.text() != text:
+                item.setText(text)
+
+    def active_clock(self):
+        return self.clock if self.clock_enabled else None
+
+    def time_over(self):
+        return self.clock_enabled and self.clock.flagged() is not None
+
+    def press_clock(self):
+        if self.clock_enabled and self.clock.flagged() is None:
+            self.clock.press(not self.board.turn)
+            self.clock_timer.start()
+            self.update_clock()
+
+    def update_clock(self):
+        white = GameClock.format(self.clock.time_left(chess.WHITE))
+        black = GameClock.format(self.clock.time_left(chess.BLACK))
+        marker = {chess.WHITE: ("\u25b6 ", ""), chess.BLACK: ("", " \u25c0")}.get(self.clock.running, ("", ""))
+        self.clock_label.setText(f"{marker[0]}White {white}   |   Black {black}{marker[1]}")
+        flagged = self.clock.flagged()
+        if flagged is not None and self.clock.running is not None:
+            self.clock.stop()
+            self.clock_timer.stop()
+            self.cancel_bot()
+            stop_engine_ponder()
+            self.selected_square = None
+            self.possible_moves.clear()
+            self.update_clock()
+            self.update_svg()
+            msg = QMessageBox()
+            msg.setWindowTitle("Game Over")
+            msg.setText(f"{'White' if flagged == chess.WHITE else 'Black'} lost on time.")
+            msg.exec_()
+
     def load_fen(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
@@ -855,23 +3552,8 @@ class ChessboardWidget(QWidget):
         if file_name:
             with open(file_name, 'r') as fen_file:
                 fen = fen_file.read()
-                self.board.set_fen(fen)
-                self.load_game_moves(self.board.move_stack)
-                self.board.set_fen(fen)
-                self.update_svg()
-                self.clear_move_list()
-                try:
-                    data = json.load(open("set.json", "r"))
-                    data["start fen"] = fen
-                    json.dump(data, open("set.json", "w"))
-                except Exception:
-                    try:
-                        data = {"last fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
-                                "move history": [],
-                                "start fen": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"}
-                        json.dump(data, open("set.json", "w"))
-                    except Exception:
-                        pass
+                self.load_game_moves([], start_fen=fen.strip())
+                self.current_game_id = None
 
     def choose_engine(self):
         options = QFileDialog.Options()
@@ -881,138 +3563,110 @@ class ChessboardWidget(QWidget):
                                                      options=options)
         if engine_path:
             self.engine_path = engine_path
-            try:
-                with open("settings.json", "r") as f:
-                    data = json.load(f)
-                data["engine(stockfish)"]["path"] = str(engine_path)
-                json.dump(data, open("settings.json", "w"))
-                f.close()
-            except Exception:
-                with open("settings.json", "w") as f:
-                    data = {"analyse": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128,
-                                        "analyse time": 3000},
-                            "bot": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128,
-                                    "move time": 3000}, "engine(stockfish)": {
-                            "path": "C:/PYTHON/ChessQT/stockfish/stockfish-windows-x86-64-avx2.exe"}}
-                data["engine(stockfish)"]["path"] = str(engine_path)
-                f.close()
-                json.dump(data, open("settings.json", "w"))
+            settings.set("engine(stockfish)", "path", str(engine_path))
 
             self.update_svg()
 
 
-class BotThread(QThread):
-    move_ready = pyqtSignal(chess.Move)
+class BotSearch(QObject):
+    move_ready = pyqtSignal(chess.Move, int)
+    search_failed = pyqtSignal(int, str)
 
-    def __init__(self, board, bot_side):
-        super(BotThread, self).__init__()
+    def __init__(self, board, bot_side, engine_path, clock=None):
+        super(BotSearch, self).__init__()
         self.board = board
+        self.clock = clock
 
         self.bot_side = bot_side
-        self.bot_depth = 32
-        self.bot_time = 5000
-        self.running = True
-        self.data = None
-        try:
-            self.data = json.load(open("settings.json", "r"))
-        except Exception:
-            self.data = {
-                "analyse": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128, "analyse time": 3000},
-                "bot": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128, "move time": 3000},
-                "engine(stockfish)": {"path": find_exe_file_in_app_root("stockfish")}}
-        self.engine_path = self.data["engine(stockfish)"]["path"]
-
-    def stop(self):
-        self.running = False
-
-    def run(self):
-        if self.bot_side == self.board.turn:
-            try:
-                stockfish_process = subprocess.Popen(
-                    [self.engine_path],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                    shell=True,
-                )
-
-                stockfish_process.stdin.write("uci\n")
-                stockfish_process.stdin.write(
-                    f"setoption name Skill Level value {self.data['bot']['skill level(min=1, max=20)']}\n")
-                stockfish_process.stdin.write(f"setoption name hash value {self.data['bot']['hash(mb)']}\n")
-                stockfish_process.stdin.write(f"setoption name threads value {self.data['bot']['threads']}\n")
-                stockfish_process.stdin.write(f"position fen {self.board.fen()}\n")
-                stockfish_process.stdin.write(f"go movetime {self.data['bot']['move time']}\n")
-
-                stockfish_process.stdin.flush()
-
-                result = None
-                for line in stockfish_process.stdout:
-                    if line.startswith("bestmove"):
-                        result = chess.Move.from_uci(line.split()[1])
-                        break
-
-                stockfish_process.kill()
-                if result:
-                    self.move_ready.emit(result)
-            except Exception:
-                pass
-
-
-class AnalyzeThread(QThread):
-    analyze_ready = pyqtSignal(chess.Move)
-
-    def __init__(self, board):
-        super(AnalyzeThread, self).__init__()
-        self.board = board
-
-        self.analysis_depth = 20
-        self.analysis_time = 6000
-        self.data = None
-        try:
-            self.data = json.load(open("settings.json", "r"))
-        except Exception:
-            self.data = {
-                "analyse": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128, "analyse time": 3000},
-                "bot": {"skill level(min=1, max=20)": 20, "hash(mb)": 1024, "threads": 128, "move time": 3000},
-                "engine(stockfish)": {"path": find_exe_file_in_app_root("stockfish")}}
+        self.request = EngineRequest()
+        self.data = settings.snapshot()
+        self.engine_path = engine_path
+        self.daemon = self.data["engine(stockfish)"]["daemon socket"]
+        self.options = settings.engine_options("bot")
+        self.identity = engine_identity(engine_path, self.options)
+        self.hub = None
+        self.started = None
+        if clock is not None:
+            self.go = clock.go_command()
+            self.budget = clock.budget(bot_side)
+        else:
+            self.go = f"go movetime {self.data['bot']['move time']}"
+            self.budget = self.data['bot']['move time']
 
-        self.engine_path = self.data["engine(stockfish)"]["path"]
+    def cancel(self):
+        self.request.cancel()
+        self.disconnect_hub()
 
-    def run(self):
+    def start(self):
+        if self.bot_side != self.board.turn:
+            return
+        self.started = time.perf_counter()
         try:
-            stockfish_process = subprocess.Popen(
-                [self.engine_path],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                shell=True,
-            )
-            stockfish_process.stdin.write("uci\n")
-            stockfish_process.stdin.write(
-                f"setoption name Skill Level value {self.data['analyse']['skill level(min=1, max=20)']}\n")
-            stockfish_process.stdin.write(f"setoption name hash value {self.data['analyse']['hash(mb)']}\n")
-            stockfish_process.stdin.write(f"setoption name threads value {self.data['analyse']['threads']}\n")
-            stockfish_process.stdin.write(f"position fen {self.board.fen()}\n")
-            stockfish_process.stdin.write(f"go movetime {self.data['analyse']['analyse time']}\n")
-            info = []
-            stockfish_process.stdin.flush()
-            for line in stockfish_process.stdout:
-                if line.startswith("info"):
-                    if "pv" in line:
-                        ind = line.index(" pv ")
-                        info.append(chess.Move.from_uci(line[ind + 4: ind + 8]))
-                        self.analyze_ready.emit(chess.Move.from_uci(line[ind + 4: ind + 8]))
-                if line.startswith("bestmove"):
-                    line = line.split()
-                    info.append(chess.Move.from_uci(line[1]))
-            stockfish_process.kill()
-        except Exception:
-            pass
+            with tracer.span("bot.book"):
+                move = book_move(self.board, self.data["book"])
+            if move is None:
+                with tracer.span("tablebase"):
+                    move = tablebase_move(self.board, self.data["syzygy"]["path"])
+            if move is None:
+                result = get_eval_cache().get(self.board, self.identity, movetime=self.budget)
+                if result is not None and result.get("bestmove"):
+                    move = chess.Move.from_uci(result["bestmove"])
+            if move is not None:
+                QTimer.singleShot(0, lambda: self.emit_move(move))
+                return
+            self.hub = get_engine_hub()
+            self.hub.result_ready.connect(self.result_ready)
+            self.hub.request_failed.connect(self.request_failed)
+            self.hub.submit("bot", self.engine_path, position_command(self.board), self.go, self.options,
+                            timeout=self.budget / 1000 + 5, token=self.request, daemon=self.daemon,
+                            early_stop=self.data["bot"]["early stop(iterations)"])
+        except Exception as error:
+            QTimer.singleShot(0, lambda: self.search_failed.emit(self.request.id, str(error)))
+
+    def disconnect_hub(self):
+        hub, self.hub = self.hub, None
+        if hub is not None:
+            hub.result_ready.disconnect(self.result_ready)
+            hub.request_failed.disconnect(self.request_failed)
+
+    def emit_move(self, move):
+        if self.request.cancelled:
+            return
+        tracer.record("bot.move", (time.perf_counter() - self.started) * 1000)
+        self.move_ready.emit(move, self.request.id)
+
+    def result_ready(self, request_id, result):
+        if request_id != self.request.id:
+            return
+        self.disconnect_hub()
+        if not result.get("bestmove"):
+            self.search_failed.emit(self.request.id, "no move")
+            return
+        get_eval_cache().put(self.board, self.identity, result, self.budget)
+        self.emit_move(chess.Move.from_uci(result["bestmove"]))
+        if self.data["bot"]["ponder"] and not self.daemon and not self.request.cancelled:
+            self.start_ponder(result, self.go if self.clock is None else self.clock.go_command())
+
+    def request_failed(self, request_id, reason):
+        if request_id == self.request.id:
+            self.disconnect_hub()
+            self.search_failed.emit(self.request.id, reason)
+
+    def start_ponder(self, result, go):
+        pv = result.get("pv") or []
+        ponder = result.get("ponder") or (pv[1] if len(pv) > 1 and pv[0] == result["bestmove"] else None)
+        if not ponder:
+            return
+        board = self.board.copy()
+        board.push_uci(result["bestmove"])
+        move = chess.Move.from_uci(ponder)
+        if board.is_legal(move):
+            board.push(move)
+            get_engine_hub().ponder(self.engine_path, position_command(board), go,
+                                    dict(self.options, Ponder="true"))
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     app = ChessboardApp(sys.argv)
     sys.exit(app.exec_())
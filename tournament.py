@@ -0,0 +1,282 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import chess
+
+import main
+
+players = {}
+
+
+def parse_options(values):
+    options = {}
+    for value in values or []:
+        name, _, option = value.partition("=")
+        options[name.strip()] = option.strip()
+    return options
+
+
+def read_openings(path):
+    if not path:
+        return [chess.STARTING_FEN]
+    openings = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                openings.append(chess.Board(line).fen())
+    return openings or [chess.STARTING_FEN]
+
+
+def cpu_slots(concurrency, threads):
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return [None] * concurrency
+    if concurrency * threads > len(cpus):
+        return [None] * concurrency
+    return [cpus[index * threads:(index + 1) * threads] for index in range(concurrency)]
+
+
+def init_worker(slots, engines):
+    cpus = slots.get()
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    players.update(engines)
+
+
+def white_score(result, board):
+    score = result.get("score")
+    if score is None:
+        return None
+    score_type, value = score
+    if score_type == "mate":
+        value = 100000 - abs(value) if value > 0 else -100000 + abs(value)
+    return value if board.turn == chess.WHITE else -value
+
+
+def adjudicate(scores, rules):
+    if rules["resign_moves"] and len(scores) >= 2 * rules["resign_moves"]:
+        recent = scores[-2 * rules["resign_moves"]:]
+        if None not in recent:
+            if all(score >= rules["resign_cp"] for score in recent):
+                return "1-0"
+            if all(score <= -rules["resign_cp"] for score in recent):
+                return "0-1"
+    if rules["draw_moves"] and len(scores) >= 2 * max(rules["draw_after"], rules["draw_moves"]):
+        recent = scores[-2 * rules["draw_moves"]:]
+        if None not in recent and all(abs(score) <= rules["draw_cp"] for score in recent):
+            return "1/2-1/2"
+    return None
+
+
+def play_game(round_number, fen, white, black, limits, rules):
+    board = chess.Board(fen)
+    hub = main.get_engine_hub()
+    sessions = {chess.WHITE: white, chess.BLACK: black}
+    new_game = {white, black}
+    clock = None
+    if limits.get("base"):
+        clock = main.GameClock(limits["base"], limits["increment"])
+    scores = []
+    result = None
+    termination = "normal"
+    while result is None:
+        if board.is_game_over(claim_draw=True):
+            result = board.result(claim_draw=True)
+            break
+        if len(board.move_stack) >= rules["max_plies"]:
+            result, termination = "1/2-1/2", "adjudication"
+            break
+        session = sessions[board.turn]
+        path, options = players[session]
+        if clock is not None:
+            clock.start(board.turn)
+            go = clock.go_command()
+        else:
+            go = f"go movetime {limits['movetime']}"
+        try:
+            search = hub.search(path, main.position_command(board), go, options=options,
+                                new_game=session in new_game, session=session)
+        except main.EngineTerminated:
+            search = {}
+        new_game.discard(session)
+        move = chess.Move.from_uci(search["bestmove"]) if search.get("bestmove") else None
+        if clock is not None:
+            clock.press(board.turn)
+            if clock.remaining[board.turn] - clock.increment < 0:
+                result, termination = ("0-1" if board.turn == chess.WHITE else "1-0"), "time forfeit"
+                break
+        if move is None or not board.is_legal(move):
+            result, termination = ("0-1" if board.turn == chess.WHITE else "1-0"), "rules infraction"
+            break
+        scores.append(white_score(search, board))
+        board.push(move)
+        result = adjudicate(scores, rules)
+        if result is not None:
+            termination = "adjudication"
+    return {"round": round_number, "start_fen": fen, "moves": [move.uci() for move in board.move_stack],
+            "white": white, "black": black, "white_name": hub.engine_name(players[white][0], white) or white,
+            "black_name": hub.engine_name(players[black][0], black) or black, "result": result,
+            "termination": termination}
+
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo_estimate(wins, draws, losses):
+    games = wins + draws + losses
+    if not games:
+        return 0.0, 0.0, 0.5
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def elo(s):
+        s = min(max(s, 1e-6), 1 - 1e-6)
+        return 400 * math.log10(s / (1 - s))
+
+    return elo(score), (elo(min(score + margin, 1)) - elo(max(score - margin, 0))) / 2, score
+
+
+def sprt(wins, draws, losses, elo0, elo1, alpha, beta):
+    games = wins + draws + losses
+    lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+    if not games or not wins + losses:
+        return 0.0, lower, upper, None
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    llr = games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance) if variance else 0.0
+    verdict = "H1 accepted" if llr >= upper else "H0 accepted" if llr <= lower else None
+    return llr, lower, upper, verdict
+
+
+def game_record(game, event):
+    headers = {"Event": event, "Site": "ChessQt tournament", "Date": datetime.date.today().strftime("%Y.%m.%d"),
+               "Round": str(game["round"]), "White": game["white_name"], "Black": game["black_name"],
+               "Result": game["result"]}
+    return {"headers": headers, "start_fen": game["start_fen"],
+            "moves": [chess.Move.from_uci(move) for move in game["moves"]]}
+
+
+def run(args):
+    first_options = main.settings.engine_options(args.settings1)
+    second_options = main.settings.engine_options(args.settings2)
+    first_options.update(parse_options(args.option1))
+    second_options.update(parse_options(args.option2))
+    if args.threads:
+        first_options["Threads"] = second_options["Threads"] = args.threads
+    engines = {"engine1": (os.path.abspath(args.engine1 or main.settings.resolve_engine()), first_options),
+               "engine2": (os.path.abspath(args.engine2 or args.engine1 or main.settings.resolve_engine()),
+                           second_options)}
+
+    openings = read_openings(args.openings)
+    if args.shuffle:
+        random.Random(args.seed).shuffle(openings)
+    schedule = []
+    for index in range(args.games):
+        fen = openings[index // 2 % len(openings)]
+        white, black = ("engine1", "engine2") if index % 2 == 0 else ("engine2", "engine1")
+        schedule.append((index + 1, fen, white, black))
+
+    limits = {"movetime": args.movetime}
+    if args.tc:
+        base, _, increment = args.tc.partition("+")
+        limits.update(base=int(float(base) * 1000), increment=int(float(increment or 0) * 1000))
+    rules = {"max_plies": args.max_plies, "resign_cp": args.resign_cp, "resign_moves": args.resign_moves,
+             "draw_cp": args.draw_cp, "draw_moves": args.draw_moves, "draw_after": args.draw_after}
+
+    store = main.get_game_store(args.db) if args.db else None
+    event = args.event or f"{os.path.basename(engines['engine1'][0])} vs {os.path.basename(engines['engine2'][0])}"
+    context = multiprocessing.get_context("spawn")
+    slots = context.Queue()
+    for cpus in cpu_slots(args.concurrency, args.threads or 1):
+        slots.put(cpus)
+
+    wins = draws = losses = 0
+    games = []
+    started = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(args.concurrency, mp_context=context, initializer=init_worker,
+                                                initargs=(slots, engines)) as pool:
+        futures = [pool.submit(play_game, *entry, limits, rules) for entry in schedule]
+        for future in concurrent.futures.as_completed(futures):
+            game = future.result()
+            games.append(game)
+            first_white = game["white"] == "engine1"
+            if game["result"] == "1/2-1/2":
+                draws += 1
+            elif (game["result"] == "1-0") == first_white:
+                wins += 1
+            else:
+                losses += 1
+            if store is not None:
+                store.add_game(game_record(game, event))
+            elo, error, _ = elo_estimate(wins, draws, losses)
+            llr, lower, upper, verdict = sprt(wins, draws, losses, args.elo0, args.elo1, args.alpha, args.beta)
+            print(f"game {game['round']:>4} {game['result']:>7} {game['termination']:<16} "
+                  f"+{wins} ={draws} -{losses}  elo {elo:+.1f} +/- {error:.1f}  "
+                  f"llr {llr:.2f} [{lower:.2f}, {upper:.2f}]",
+                  flush=True)
+            if args.sprt and verdict:
+                for pending in futures:
+                    pending.cancel()
+                break
+
+    elo, error, score = elo_estimate(wins, draws, losses)
+    llr, lower, upper, verdict = sprt(wins, draws, losses, args.elo0, args.elo1, args.alpha, args.beta)
+    return {"engine1": engines["engine1"][0], "engine2": engines["engine2"][0], "games": len(games),
+            "wins": wins, "draws": draws, "losses": losses, "score": score, "elo": elo, "elo_error": error,
+            "sprt": {"elo0": args.elo0, "elo1": args.elo1, "alpha": args.alpha, "beta": args.beta, "llr": llr,
+                     "lower": lower, "upper": upper, "verdict": verdict},
+            "seconds": time.monotonic() - started}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play engine-vs-engine matches headlessly and report Elo/SPRT.")
+    parser.add_argument("--engine1", help="first engine (defaults to the engine in settings.json)")
+    parser.add_argument("--engine2", help="second engine (defaults to engine1)")
+    parser.add_argument("--settings1", default="bot", choices=["bot", "analyse"],
+                        help="settings.json section with skill level, hash and threads for engine1")
+    parser.add_argument("--settings2", default="bot", choices=["bot", "analyse"])
+    parser.add_argument("--option1", action="append", help="extra UCI option for engine1, as Name=Value")
+    parser.add_argument("--option2", action="append", help="extra UCI option for engine2, as Name=Value")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads", type=int, default=1, help="engine threads per game (0 keeps settings.json)")
+    parser.add_argument("--movetime", type=int, default=100, help="ms per move when --tc is not given")
+    parser.add_argument("--tc", help="time control as base+increment in seconds, e.g. 10+0.1")
+    parser.add_argument("--openings", help="file with one FEN per line; each opening is played with both colours")
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-plies", type=int, default=400)
+    parser.add_argument("--resign-cp", type=int, default=1000)
+    parser.add_argument("--resign-moves", type=int, default=4, help="0 disables resign adjudication")
+    parser.add_argument("--draw-cp", type=int, default=10)
+    parser.add_argument("--draw-moves", type=int, default=8, help="0 disables draw adjudication")
+    parser.add_argument("--draw-after", type=int, default=40, help="earliest move number for draw adjudication")
+    parser.add_argument("--sprt", action="store_true", help="stop as soon as the SPRT reaches a verdict")
+    parser.add_argument("--elo0", type=float, default=0.0)
+    parser.add_argument("--elo1", type=float, default=5.0)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--db", default="tournament.db", help="game store for the played games (empty to skip)")
+    parser.add_argument("--event")
+    parser.add_argument("--json", help="write the summary here")
+    args = parser.parse_args()
+
+    summary = run(args)
+    print(f"{summary['games']} games: +{summary['wins']} ={summary['draws']} -{summary['losses']}, "
+          f"score {summary['score']:.3f}, elo {summary['elo']:+.1f} +/- {summary['elo_error']:.1f}, "
+          f"llr {summary['sprt']['llr']:.2f} {summary['sprt']['verdict'] or ''}".rstrip())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)